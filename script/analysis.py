@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Publication counts of junior faculty by rank, school and hire cohort,
+with bootstrap confidence intervals, from the index built by
+publication_index.py. Counts are computed per faculty member once and
+each group is resampled in chunks of at most -chunk draws, so memory
+stays bounded however large the group or the number of resamples.
+Aggregates are cached by a hash of the values of the group, so only
+groups whose inputs changed are resampled again. Needs numpy and
+pandas.
+"""
+import sys
+import argparse
+import logging
+import os
+import json
+import zlib
+import hashlib
+import sqlite3
+import numpy as np
+import pandas as pd
+
+
+# set argument parser
+parser = argparse.ArgumentParser(description='Tabulate publication counts with bootstrap CIs.')
+parser.add_argument("-db", type = str,
+                    help = "SQLite file built by publication_index.py.",
+                    default = "data/publications.sqlite")
+parser.add_argument("-schools", type = str, choices = ["top25", "all"],
+                    help = "Schools included in the tables.",
+                    default = "top25")
+parser.add_argument("-resamples", type = int,
+                    help = "Number of bootstrap resamples.",
+                    default = 10000)
+parser.add_argument("-chunk", type = int,
+                    help = "Most draws held in memory at once while resampling.",
+                    default = 1000000)
+parser.add_argument("-seed", type = int,
+                    help = "Seed of the bootstrap.",
+                    default = 2019)
+parser.add_argument("-cohort", type = int,
+                    help = "Width in years of the hire cohorts.",
+                    default = 5)
+parser.add_argument("-cache", type = str,
+                    help = "json file caching the aggregates.",
+                    default = "data/analysis_cache.json")
+parser.add_argument("-outdir", type = str,
+                    help = "Directory the tables are written to as csv.",
+                    default = "data/tables")
+parser.add_argument("-v", "--verbose",
+                    help = "Set logging level to DEBUG.",
+                    action = "store_true")
+args = parser.parse_args(None if __name__ == "__main__" else [])
+
+
+# set logging
+log = logging.getLogger(__name__)
+log.setLevel(logging.ERROR)
+if args.verbose:
+    log.setLevel(logging.DEBUG)
+loghandler = logging.StreamHandler(sys.stderr)
+loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+log.addHandler(loghandler)
+
+
+measures = ["publications", "peer_reviewed", "peer_reviewed_at_hire"]
+tables = {"rank": ["rank"], "school": ["school"], "cohort": ["rank", "cohort"]}
+
+# bump when the statistics change so cached aggregates are recomputed
+version = 1
+
+
+def load(db, schools = "top25"):
+    """
+    One row per faculty member with a CV: school, name, rank,
+    hire year and the counts in `measures`.
+    --------
+    db (str, SQLite file built by publication_index.py)
+    schools (str, "top25" or "all")
+    """
+    conn = sqlite3.connect(db)
+    faculty = pd.read_sql_query("""
+        SELECT f.school, f.name, f.rank, f.hire_year
+        FROM faculty f JOIN schools s ON s.school = f.school
+        WHERE f.cv_sha256 IS NOT NULL AND s.top25 >= ?""", conn,
+        params = (int(schools == "top25"),))
+    publications = pd.read_sql_query(
+        "SELECT school, name, year, peer_reviewed FROM publications", conn)
+    conn.close()
+
+    publications = publications.merge(faculty[["school", "name", "hire_year"]],
+                                      on = ["school", "name"])
+    peer = publications["peer_reviewed"] == 1
+    publications["publications"] = publications["year"].notna()
+    publications["peer_reviewed"] = peer
+    publications["peer_reviewed_at_hire"] = peer & (publications["year"]
+                                                    <= publications["hire_year"])
+    counts = publications.groupby(["school", "name"])[measures].sum()
+    faculty = faculty.join(counts, on = ["school", "name"])
+    faculty[measures] = faculty[measures].fillna(0).astype(int)
+    faculty["rank"] = faculty["rank"].fillna("Unknown")
+    return faculty
+
+
+def add_cohort(faculty, width):
+    """
+    Label each faculty member with the `width`-year cohort of their
+    hire year, e.g. "2010-2014".
+    --------
+    faculty (pandas.DataFrame, output of load)
+    width (int, years per cohort)
+    """
+    start = (faculty["hire_year"] // width) * width
+    faculty["cohort"] = ["{}-{}".format(int(s), int(s) + width - 1) if pd.notna(s) else "Unknown"
+                         for s in start]
+    return faculty
+
+
+def bootstrap(values, resamples, rng, chunk = 1000000):
+    """
+    Mean and median of `values` with 95% percentile intervals from
+    `resamples` resamples, drawn `chunk` values at a time. The draws
+    follow one another in the stream of `rng`, so the intervals do not
+    depend on `chunk`.
+    --------
+    values (numpy array, one count per faculty member)
+    resamples (int, number of bootstrap resamples)
+    rng (numpy.random.Generator)
+    chunk (int, most values drawn at once)
+    """
+    n = len(values)
+    rows = max(1, chunk // max(1, n))
+    means = np.empty(resamples)
+    medians = np.empty(resamples)
+    for start in range(0, resamples, rows):
+        stop = min(start + rows, resamples)
+        samples = values[rng.integers(0, n, size = (stop - start, n))]
+        means[start:stop] = samples.mean(axis = 1)
+        medians[start:stop] = np.median(samples, axis = 1)
+    mean_low, mean_high = np.percentile(means, [2.5, 97.5])
+    median_low, median_high = np.percentile(medians, [2.5, 97.5])
+    return {"n": int(len(values)),
+            "mean": float(values.mean()), "mean_low": float(mean_low),
+            "mean_high": float(mean_high),
+            "median": float(np.median(values)), "median_low": float(median_low),
+            "median_high": float(median_high)}
+
+
+def fingerprint(values, measure):
+    """
+    Hash of everything an aggregate depends on.
+    --------
+    values (numpy array, counts of the group)
+    measure (str, column the counts come from)
+    """
+    digest = hashlib.sha256(np.sort(values).astype(np.int64).tobytes())
+    digest.update(json.dumps([measure, args.resamples, args.seed, version]).encode())
+    return digest.hexdigest()
+
+
+def tabulate(faculty, name, by, cache):
+    """
+    Aggregates of every measure for each group of `by`. Groups whose
+    values did not change since the cached run are taken from `cache`.
+    Each group has its own random stream, so a result does not depend
+    on which other groups were recomputed.
+    --------
+    faculty (pandas.DataFrame, output of add_cohort)
+    name (str, name of the table)
+    by (list, columns defining the groups)
+    cache (dict, {table: {group: {measure: {"hash", "row"}}}})
+    """
+    cached = cache.setdefault(name, {})
+    rows = []
+    recomputed = 0
+    for keys, group in faculty.groupby(by, sort = True):
+        keys = keys if isinstance(keys, tuple) else (keys,)
+        label = " | ".join(str(k) for k in keys)
+        entry = cached.setdefault(label, {})
+        row = dict(zip(by, keys))
+        for measure in measures:
+            values = group[measure].to_numpy()
+            key = fingerprint(values, measure)
+            if entry.get(measure, {}).get("hash") != key:
+                rng = np.random.default_rng([args.seed, zlib.crc32(
+                    "{}/{}/{}".format(name, label, measure).encode())])
+                entry[measure] = {"hash": key,
+                                  "row": bootstrap(values, args.resamples, rng,
+                                                   args.chunk)}
+                recomputed += 1
+            row.update({"{}_{}".format(measure, stat): value
+                        for stat, value in entry[measure]["row"].items()})
+        rows.append(row)
+    log.info("{}: {} aggregates recomputed".format(name, recomputed))
+    return pd.DataFrame(rows)
+
+
+def read_cache(path):
+    try:
+        with open(path) as j:
+            return json.load(j)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    with open(path + ".tmp", "w") as j:
+        json.dump(cache, j)
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == "__main__":
+
+    faculty = add_cohort(load(args.db, args.schools), args.cohort)
+    log.info("{} faculty with a CV".format(len(faculty)))
+
+    cache = read_cache(args.cache)
+    os.makedirs(args.outdir, exist_ok = True)
+    for name, by in tables.items():
+        name = "{}_{}".format(name, args.schools)
+        table = tabulate(faculty, name, by, cache)
+        table.to_csv(os.path.join(args.outdir, name + ".csv"), index = False)
+        print(table[by + ["peer_reviewed_at_hire_n", "peer_reviewed_at_hire_mean",
+                          "peer_reviewed_at_hire_mean_low",
+                          "peer_reviewed_at_hire_mean_high"]].to_string(index = False))
+    save_cache(cache, args.cache)
+
+    sys.exit()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark the parsers in get_junior_faculty.py on the pages saved in
+data/faculty_page. Each school runs in a fresh process and reports
+parse time, peak memory, node count and a digest of the roster it
+wrote. Results are compared with a baseline json so slower parsers
+and changed rosters are flagged.
+"""
+import sys
+import argparse
+import logging
+import os
+import io
+import json
+import time
+import glob
+import hashlib
+import resource
+import shutil
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from lxml import etree
+import get_junior_faculty as gjf
+
+
+# set argument parser
+parser = argparse.ArgumentParser(description='Benchmark the faculty page parsers.')
+parser.add_argument("-pagedir", type = str,
+                    help = "Directory storing the saved faculty pages.",
+                    default = "data/faculty_page")
+parser.add_argument("-backend", type = str,
+                    help = "HTML parsing backend.",
+                    choices = ["lxml", "bs4", "stream"],
+                    default = "lxml")
+parser.add_argument("-repeat", type = int,
+                    help = "Number of timed runs per school, the fastest is kept.",
+                    default = 5)
+parser.add_argument("-baseline", type = str,
+                    help = "Baseline json to compare with.",
+                    default = "data/bench_baseline.json")
+parser.add_argument("-tolerance", type = float,
+                    help = "Allowed slowdown over the baseline, as a fraction.",
+                    default = 0.25)
+parser.add_argument("--save",
+                    help = "Write the results as the new baseline.",
+                    action = "store_true")
+parser.add_argument("-v", "--verbose", 
+                    help = "Set logging level to DEBUG.",
+                    action = "store_true")
+args = parser.parse_args()
+
+
+# set logging
+log = logging.getLogger(__name__)
+log.setLevel(logging.ERROR)
+if args.verbose:
+    log.setLevel(logging.DEBUG)
+loghandler = logging.StreamHandler(sys.stderr)
+loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+log.addHandler(loghandler)
+
+
+# schools with a parser that runs on the saved pages alone
+schools = [school for school, site in gjf.sites.items()
+           if site.parses() and not site.profiles]
+
+
+def count_nodes(school):
+    """
+    Number of elements in the saved pages of a school.
+    --------
+    school (str, name of the school)
+    """
+    prefix = school.replace(" ", "_") + "_faculty_page"
+    nodes = 0
+    for page in glob.glob(os.path.join(args.pagedir, glob.escape(prefix) + "*.html")):
+        with open(page) as h:
+            doc = etree.fromstring(h.read(), etree.HTMLParser())
+        nodes += 0 if doc is None else sum(1 for _ in doc.iter())
+    return nodes
+
+
+def bench_school(school, url):
+    """
+    Parse the saved pages of one school. Runs in its own process so
+    that the resident memory reported belongs to this school only.
+    --------
+    school (str, name of the school)
+    url (str, url to the faculty page)
+    """
+    gjf.args.offline = True
+    gjf.args.no_record = True
+    gjf.args.backend = args.backend
+    gjf.args.pagedir = args.pagedir
+    gjf.args.parsedir = tempfile.mkdtemp()
+    gjf.args.ranksdir = tempfile.mkdtemp()
+
+    # the pages are read once, so only the parsers are timed; the
+    # reader is replaced in this process only, which serves one school
+    pages = {}
+    count = 0
+    while True:
+        html = gjf.read_html(school, url, count)
+        if html is None:
+            break
+        pages[count] = html
+        count += 1
+    gjf.read_html = lambda school, url, count = 0: pages.get(count)
+    encoded = {count: html.encode("utf-8") for count, html in pages.items()}
+    gjf.page_source = lambda count = 0: io.BytesIO(encoded[count])
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        gjf.reparse(school, url)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    gjf.reparse(school, url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # digest of the rosters written
+    digest = hashlib.sha1()
+    names = 0
+    for file in sorted(os.listdir(gjf.args.parsedir)):
+        with open(os.path.join(gjf.args.parsedir, file), "rb") as j:
+            content = j.read()
+        digest.update(content)
+        names += len(json.loads(content))
+        os.remove(os.path.join(gjf.args.parsedir, file))
+    os.rmdir(gjf.args.parsedir)
+    shutil.rmtree(gjf.args.ranksdir)
+
+    return {"seconds": min(times),
+            "peak_python_kb": peak // 1024,
+            "rss_growth_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+            "nodes": count_nodes(school),
+            "names": names,
+            "roster_sha1": digest.hexdigest()}
+
+
+def compare(results, baseline):
+    """
+    Flag schools that got slower than the tolerance allows or whose
+    roster changed. Returns the number of flagged schools.
+    --------
+    results (dict, school to benchmark result)
+    baseline (dict, school to benchmark result)
+    """
+    flagged = 0
+    for school, result in results.items():
+        if school not in baseline:
+            continue
+        before = baseline[school]
+        if result["seconds"] > before["seconds"] * (1 + args.tolerance):
+            print("SLOWER   {}: {:.1f} ms -> {:.1f} ms".format(
+                school, before["seconds"] * 1000, result["seconds"] * 1000))
+            flagged += 1
+        if result["roster_sha1"] != before["roster_sha1"]:
+            print("CHANGED  {}: {} -> {} names".format(
+                school, before["names"], result["names"]))
+            flagged += 1
+    return flagged
+
+
+if __name__ == "__main__":
+    
+    with open("data/faculty_page_links.json") as j:
+        dict_ = json.load(j)
+    
+    results = {}
+    with ProcessPoolExecutor(max_workers = 1, max_tasks_per_child = 1) as pool:
+        for school in schools:
+            results[school] = pool.submit(bench_school, school, dict_[school]).result()
+            log.info("Benchmarked {}".format(school))
+    
+    print("{:45s} {:>9s} {:>9s} {:>9s} {:>7s} {:>6s}".format(
+        "school", "ms", "py KB", "rss KB", "nodes", "names"))
+    for school, result in results.items():
+        print("{:45s} {:9.1f} {:9d} {:9d} {:7d} {:6d}".format(
+            school[:45], result["seconds"] * 1000, result["peak_python_kb"],
+            result["rss_growth_kb"], result["nodes"], result["names"]))
+    print("{:45s} {:9.1f}".format("total",
+          sum(r["seconds"] for r in results.values()) * 1000))
+    
+    flagged = 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as j:
+            flagged = compare(results, json.load(j))
+    if args.save:
+        with open(args.baseline, "w") as j:
+            json.dump(results, j, indent = 2)
+        log.info("Saved baseline to {}".format(args.baseline))
+    
+    sys.exit(1 if flagged else 0)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Search layer for search_cv.py. Queries go to a pluggable backend
+(Google, or a local json index standing in for it), run concurrently
+within the backend's rate limit in the shared scheduler, and their
+results are kept in an on-disk cache keyed by query, so searching
+again for an unchanged roster makes no network call until the
+results expire.
+Run as a script to write the CV manifest of the rosters for
+download_cv.py.
+"""
+import re
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+log = logging.getLogger(__name__)
+
+pdf_link = re.compile(r"\.pdf$", re.I)
+dropbox_link = re.compile(r"\.pdf\?dl=0$", re.I)
+drive_link = re.compile(r"//(?:drive|docs)\.google\.com/")
+
+
+def classify(url):
+    """
+    The url to open for a search result that may be a CV, None if it
+    is not a pdf, a Dropbox pdf or a Google Drive file. Dropbox preview
+    links are turned into direct downloads.
+    --------
+    url (str, search result)
+    """
+    if pdf_link.search(url):
+        return url
+    if dropbox_link.search(url):
+        return url[:-len("?dl=0")] + "?dl=1"
+    if drive_link.search(url):
+        return url
+    return None
+
+
+def query(name):
+    return name + " CV" + " pdf"
+
+
+class GoogleBackend:
+    """
+    Google results through the googlesearch package.
+    --------
+    results (int, number of results kept per query)
+    """
+
+    host = "www.google.com"
+
+    def __init__(self, results = 1):
+        from googlesearch import search
+        self.search_ = search
+        self.results = results
+
+    def search(self, query):
+        # pacing is left to the scheduler
+        return [str(r) for r in self.search_(query, tld = "com", num = 5,
+                                             stop = self.results, pause = 0)]
+
+
+class LocalIndex:
+    """
+    Results read from a json file {query: [urls]}, for tests and for
+    searching offline.
+    --------
+    path (str, json file of the index)
+    """
+
+    # no network, so no rate limit
+    host = None
+
+    def __init__(self, path):
+        with open(path) as j:
+            self.index = json.load(j)
+
+    def search(self, query):
+        return list(self.index.get(query, []))
+
+
+def search_all(queries, backend, cache, scheduler, workers = 4):
+    """
+    Return {query: urls} for every query. Results still fresh in
+    `cache` are reused and the other queries run concurrently, each
+    waiting for a token of the backend's host in `scheduler`. A query
+    that fails is logged and left out, and uncached so it runs again
+    next time; the results found are cached whatever happens.
+    --------
+    queries (list, search queries)
+    backend (GoogleBackend or LocalIndex)
+    cache (profiles.ProfileCache, results keyed by query)
+    scheduler (scheduler.Scheduler)
+    workers (int, number of queries running at the same time)
+    """
+    results = {}
+    missing = []
+    for q in dict.fromkeys(queries):
+        if cache.fresh(q):
+            results[q] = cache.get(q)
+        else:
+            missing.append(q)
+    log.info("{} queries cached, {} to search".format(len(results), len(missing)))
+
+    def search(q):
+        if backend.host is None:
+            return backend.search(q)
+        with scheduler.slot(backend.host):
+            try:
+                urls = backend.search(q)
+            except Exception:
+                scheduler.record(backend.host, False)
+                raise
+        scheduler.record(backend.host, True)
+        return urls
+
+    def run(q):
+        try:
+            return search(q)
+        except Exception as e:
+            log.error("Search failed for {}: {!r}".format(q, e))
+            return None
+
+    if missing:
+        try:
+            with ThreadPoolExecutor(max_workers = workers) as pool:
+                for q, urls in zip(missing, pool.map(run, missing)):
+                    if urls is not None:
+                        results[q] = urls
+                        cache.put(q, urls)
+        finally:
+            cache.save()
+    return results
+
+
+if __name__ == "__main__":
+
+    # write the manifest download_cv.py reads, without a browser
+    import sys
+    import os
+    import csv
+    import argparse
+    import metrics
+    import profiles
+    import scheduler
+    import roster_store
+
+    # set argument parser
+    parser = argparse.ArgumentParser(description='Search the CV of every person on the rosters.')
+    parser.add_argument("-rosters", type = str,
+                        help = "SQLite roster store of the faculty to search for.",
+                        default = "data/rosters.sqlite")
+    parser.add_argument("-namesdir", type = str,
+                        help = "Directory of the json rosters, imported when the roster store has none.",
+                        default = "data/faculty_names")
+    parser.add_argument("-manifest", type = str,
+                        help = "CSV of the CV urls found, urls already in it are kept.",
+                        default = "data/cv_manifest.csv")
+    parser.add_argument("-search-backend", type = str,
+                        help = "Where search results come from.",
+                        choices = ["google", "local"],
+                        default = "google")
+    parser.add_argument("-index", type = str,
+                        help = "Json file {query: [urls]} used by the local search backend.",
+                        default = "data/search_index.json")
+    parser.add_argument("-results", type = int,
+                        help = "Number of search results kept per name.",
+                        default = 1)
+    parser.add_argument("-searchcache", type = str,
+                        help = "Json file caching search results by query.",
+                        default = "data/search_cache.json")
+    parser.add_argument("-search-ttl", type = float,
+                        help = "Days cached search results stay valid.",
+                        default = 90)
+    parser.add_argument("-rate", type = float,
+                        help = "Search queries allowed per minute.",
+                        default = 30)
+    parser.add_argument("-workers", type = int,
+                        help = "Number of searches running at the same time.",
+                        default = 4)
+    parser.add_argument("-metrics", type = str,
+                        help = "Jsonl file recording the timing of the stage.")
+    parser.add_argument("-v", "--verbose",
+                        help = "Set logging level to DEBUG.",
+                        action = "store_true")
+    args = parser.parse_args()
+
+    # set logging
+    log.setLevel(logging.ERROR)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    loghandler = logging.StreamHandler(sys.stderr)
+    loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    log.addHandler(loghandler)
+
+    metrics.configure(args.metrics)
+    backend = (LocalIndex(args.index) if args.search_backend == "local"
+               else GoogleBackend(args.results))
+    cache = profiles.ProfileCache(args.searchcache, args.search_ttl * 24 * 3600)
+    if backend.host is not None:
+        scheduler.default.limit(backend.host, args.rate / 60)
+
+    # urls set by hand in an earlier manifest win over the search
+    kept = {}
+    if os.path.exists(args.manifest):
+        with open(args.manifest, newline = "") as f:
+            kept = {row["name"]: row["url"] for row in csv.DictReader(f) if row.get("url")}
+
+    people = [(school, name) for school, _, name
+              in roster_store.open_store(args.rosters, args.namesdir).roster()
+              if not re.search("people", name, re.IGNORECASE)]
+    with metrics.stage("cv_urls"):
+        found = search_all([query(name) for _, name in people if name not in kept],
+                           backend, cache, scheduler.default, args.workers)
+
+    with open(args.manifest + ".tmp", "w", newline = "") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "url", "school"])
+        for school, name in people:
+            url = kept.get(name) or next(
+                (url for url in map(classify, found.get(query(name), [])) if url), "")
+            writer.writerow([name, url, school])
+    os.replace(args.manifest + ".tmp", args.manifest)
+    log.info("{} of {} people have a CV url".format(
+        sum(1 for school, name in people if kept.get(name) or any(
+            map(classify, found.get(query(name), [])))), len(people)))
+
+    sys.exit()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store for the CVs in data/faculty_cv. Every CV is
+kept once under the sha256 of its bytes, hard-linked to the file in
+data/faculty_cv when possible, and an index maps each faculty member
+(by the usual file name, spaces and dots removed) to the hash of the
+current CV and the history of the versions fetched before it.
+Run as a script to add the CVs already in data/faculty_cv.
+"""
+import sys
+import argparse
+import logging
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+
+log = logging.getLogger(__name__)
+
+cv_extensions = (".pdf", ".html", "")
+
+
+def sha256_file(path, chunk_size = 64 * 1024):
+    """
+    sha256 of a file, read in chunks.
+    --------
+    path (str, file to hash)
+    chunk_size (int, bytes read at a time)
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class CVStore:
+    """
+    objects/<first two hex digits>/<sha256> holds the bytes and
+    index.json holds, for each faculty member,
+    {"current": sha256, "history": [{"sha256", "url", "file",
+    "fetched", "headers"}, ...]} with one history entry per distinct
+    version, oldest first.
+    --------
+    root (str, directory of the store)
+    """
+
+    def __init__(self, root = "data/cv_store"):
+        self.root = root
+        self.indexfile = os.path.join(root, "index.json")
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(root, "objects"), exist_ok = True)
+        try:
+            with open(self.indexfile) as j:
+                self.index = json.load(j)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def current(self, key):
+        """
+        Hash of the current CV of `key`, None if it has none.
+        --------
+        key (str, file name of the CV without extension)
+        """
+        entry = self.index.get(key)
+        return entry["current"] if entry else None
+
+    def changed(self, key, sha256):
+        """
+        Whether `sha256` differs from the current CV of `key`.
+        --------
+        key (str, file name of the CV without extension)
+        sha256 (str, hash of the candidate CV)
+        """
+        return self.current(key) != sha256
+
+    def add(self, key, path, url = None, headers = None):
+        """
+        Add the CV at `path` as the current version for `key`. The
+        bytes are stored only if no CV with the same hash exists and a
+        history entry is added only if the content changed. Returns
+        (sha256, changed).
+        --------
+        key (str, file name of the CV without extension)
+        path (str, CV file to add)
+        url (str, url it was fetched from)
+        headers (dict, response headers saved with it)
+        """
+        sha256 = sha256_file(path)
+        obj = self.object_path(sha256)
+        with self.lock:
+            if not os.path.exists(obj):
+                os.makedirs(os.path.dirname(obj), exist_ok = True)
+                try:
+                    os.link(path, obj)
+                except OSError:
+                    shutil.copyfile(path, obj)
+            if not self.changed(key, sha256):
+                return sha256, False
+            entry = self.index.setdefault(key, {"current": None, "history": []})
+            entry["current"] = sha256
+            entry["history"].append({"sha256": sha256,
+                                     "url": url,
+                                     "file": os.path.basename(path),
+                                     "fetched": time.time(),
+                                     "headers": headers})
+            self.save()
+        return sha256, True
+
+    def duplicates(self):
+        """
+        Hashes shared by the current CVs of several faculty members.
+        """
+        keys = {}
+        for key, entry in self.index.items():
+            keys.setdefault(entry["current"], []).append(key)
+        return {sha256: k for sha256, k in keys.items() if len(k) > 1}
+
+    def save(self):
+        """
+        Write the index. Must be called with the lock held.
+        """
+        with open(self.indexfile + ".tmp", "w") as j:
+            json.dump(self.index, j, indent = 1)
+        os.replace(self.indexfile + ".tmp", self.indexfile)
+
+
+if __name__ == "__main__":
+
+    # set argument parser
+    parser = argparse.ArgumentParser(description='Add saved CVs to the content-addressed store.')
+    parser.add_argument("-cvdir", type = str,
+                        help = "Directory storing the CVs.",
+                        default = "data/faculty_cv")
+    parser.add_argument("-storedir", type = str,
+                        help = "Directory of the CV store.",
+                        default = "data/cv_store")
+    parser.add_argument("-v", "--verbose",
+                        help = "Set logging level to DEBUG.",
+                        action = "store_true")
+    args = parser.parse_args()
+
+    # set logging
+    log.setLevel(logging.ERROR)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    loghandler = logging.StreamHandler(sys.stderr)
+    loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    log.addHandler(loghandler)
+
+    store = CVStore(args.storedir)
+    for file in sorted(os.listdir(args.cvdir)):
+        key, ext = os.path.splitext(file)
+        if ext not in cv_extensions or file.startswith("."):
+            continue
+        try:
+            with open(os.path.join(args.cvdir, key + ".json")) as j:
+                headers = json.load(j)
+        except (OSError, ValueError):
+            headers = None
+        sha256, changed = store.add(key, os.path.join(args.cvdir, file),
+                                    headers = headers)
+        log.info("{} {} {}".format(sha256[:12], "added" if changed else "unchanged", file))
+    for sha256, keys in store.duplicates().items():
+        print("{} shared by {}".format(sha256[:12], ", ".join(keys)))
+
+    sys.exit()
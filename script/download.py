@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Download CVs to data/faculty_cv without holding them in memory.
+The body is streamed in chunks to `<file>.part`, checked against the
+length the server announced and renamed over `<file>` only when
+complete. A `.part` left by an interrupted transfer is resumed with
+a Range request on the next run.
+"""
+import os
+import json
+import time
+import logging
+import requests
+import http_cache
+import metrics
+
+
+log = logging.getLogger(__name__)
+
+user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/72.0.3626.109 Safari/537.36"
+
+
+class IncompleteDownload(requests.exceptions.RequestException):
+    """
+    The transfer ended before the announced length was received.
+    The partial file is kept so the next attempt resumes it.
+    """
+
+
+def expected_length(r, offset):
+    """
+    Total size of the file according to the response headers,
+    None if the server did not say.
+    --------
+    r (requests.Response, 200 or 206 response)
+    offset (int, bytes already on disk)
+    """
+    if r.status_code == 206:
+        total = r.headers.get("content-range", "").rpartition("/")[2]
+        return int(total) if total.isdigit() else None
+    length = r.headers.get("content-length")
+    return int(length) if length and length.isdigit() else None
+
+
+def stream_download(session, url, path, headers = None, chunk_size = 16 * 1024):
+    """
+    GET `url` and stream the body to `path`. Returns the response;
+    the body is on disk only if the status was 200 or 206.
+    --------
+    session (requests.Session or the requests module)
+    url (str, url to download)
+    path (str, file to write)
+    headers (dict, request headers)
+    chunk_size (int, bytes read at a time)
+    """
+    headers = dict(headers or {})
+    # ranges and lengths refer to the bytes as stored
+    headers["Accept-Encoding"] = "identity"
+    part = path + ".part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    start = time.perf_counter()
+    if offset:
+        headers.pop("If-None-Match", None)
+        headers.pop("If-Modified-Since", None)
+        headers["Range"] = "bytes={}-".format(offset)
+        # only resume if the file has not changed since
+        validator = http_cache.validators(http_cache.read_sidecar(part + ".json"))
+        if validator:
+            headers["If-Range"] = validator.get("If-None-Match",
+                                                validator.get("If-Modified-Since"))
+
+    with session.get(url, headers = headers, stream = True) as r:
+        if r.status_code == 416 and offset:
+            log.info("Cannot resume {}, starting over".format(url))
+            os.remove(part)
+            return stream_download(session, url, path, headers = {
+                k: v for k, v in headers.items() if k not in ("Range", "If-Range")},
+                chunk_size = chunk_size)
+        if r.status_code == 206:
+            mode = "ab"
+            log.info("Resuming {} at byte {}".format(url, offset))
+        elif r.status_code == 200:
+            mode = "wb"
+            with open(part + ".json", "w") as j:
+                json.dump(dict(r.headers), j)
+        else:
+            return r
+
+        with open(part, mode) as f:
+            for chunk in r.iter_content(chunk_size):
+                f.write(chunk)
+        size = os.path.getsize(part)
+        metrics.record("download", url = url, status = r.status_code, offset = offset,
+                       bytes = size - (offset if mode == "ab" else 0),
+                       seconds = round(time.perf_counter() - start, 4))
+        expected = expected_length(r, offset)
+        if expected is not None and size != expected:
+            raise IncompleteDownload("Received {} of {} bytes from {}".format(
+                size, expected, url), response = r)
+    os.replace(part, path)
+    os.remove(part + ".json")
+    return r
+
+
+def cv_path(cvdir, name, url):
+    """
+    Where the CV of `name` is saved: the path without extension,
+    used for the json sidecar, and the CV file itself.
+    --------
+    cvdir (str, directory storing the CVs)
+    name (str, name of the junior faculty)
+    url (str, url of the professor's CV)
+    """
+    filename = name.replace(" ", "").replace(".", "")
+    path = os.path.join(cvdir, filename)
+    if url.endswith(".pdf"):
+        return path, path + ".pdf"
+    if url.endswith(".html"):
+        return path, path + ".html"
+    return path, path
+
+
+def download_cv(name, url, cvdir, session = requests, revalidate = True,
+                store = None):
+    """
+    Download a CV and save the response headers next to it. The CV
+    is named after the faculty member with spaces and dots removed.
+    With `revalidate`, a CV already on disk is only downloaded again
+    if the server says it changed since its saved headers.
+    --------
+    name (str, name of the junior faculty)
+    url (str, url of the professor's CV)
+    cvdir (str, directory storing the CVs)
+    session (requests.Session or the requests module)
+    revalidate (bool, send the saved ETag/Last-Modified)
+    store (cv_store.CVStore, content-addressed store to add the CV to)
+    """
+    headers = {'Accept': 'text/html; charset=iso-8859-1',
+               'User-Agent': user_agent}
+    path, target = cv_path(cvdir, name, url)
+    if revalidate and os.path.exists(target):
+        headers.update(http_cache.validators(http_cache.read_sidecar(path + ".json")))
+    r = stream_download(session, url, target, headers)
+    if r.status_code not in (200, 206, 304):
+        # the sidecar keeps describing the CV on disk, not the error
+        log.error("CV not saved for {}: {}".format(name, r.status_code))
+        r.raise_for_status()
+        return r
+
+    # save meta information in json
+    meta = dict(r.headers)
+    if r.status_code == 206:
+        meta = {k: v for k, v in r.headers.items() if k.lower() != "content-range"}
+        meta["Content-Length"] = str(os.path.getsize(target))
+    if r.status_code == 304:
+        meta = http_cache.read_sidecar(path + ".json")
+        meta.update({k: v for k, v in r.headers.items()
+                     if k.lower() != "content-length"})
+        log.info("CV not modified for {}".format(name))
+    with open(path + ".json", "w") as j:
+        json.dump(dict(meta), j)
+    log.info("CV accessed for {}".format(name))
+    if store is not None and r.status_code in (200, 206):
+        sha256, changed = store.add(os.path.basename(path), target, url, meta)
+        if not changed:
+            log.info("Same CV as before for {}".format(name))
+    return r
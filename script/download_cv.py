@@ -12,6 +12,18 @@ import requests
 import re
 import json
 import os
+import csv
+import time
+import threading
+import download
+import cv_store
+import scheduler
+import replay_server
+import metrics
+import roster_store
+from urllib.parse import urlparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 # set argument parser
@@ -19,9 +31,39 @@ parser = argparse.ArgumentParser(description='Download CV.')
 parser.add_argument("-cvdir", type = str,
                     help = "Directory to store output of this file.",
                     default = "data/faculty_cv")
+parser.add_argument("-rosters", type = str,
+                    help = "SQLite roster store of the faculty.",
+                    default = "data/rosters.sqlite")
 parser.add_argument("-namesdir", type = str,
-                    help = "Directory storing faculty roster.",
+                    help = "Directory of the json rosters, imported when the roster store has none.",
                     default = "data/faculty_names")
+parser.add_argument("-manifest", type = str,
+                    help = "CSV or JSONL file with name and url columns. Downloads without prompting.")
+parser.add_argument("-results", type = str,
+                    help = "JSONL file storing the outcome of each batch download.",
+                    default = "data/cv_download_results.jsonl")
+parser.add_argument("-workers", type = int,
+                    help = "Number of CVs downloaded at the same time.",
+                    default = 8)
+parser.add_argument("-per-host", type = int,
+                    help = "Number of CVs downloaded at the same time from one host.",
+                    default = 2)
+parser.add_argument("-rate", type = float,
+                    help = "Requests per second to one host.",
+                    default = 2)
+parser.add_argument("-storedir", type = str,
+                    help = "Directory of the content-addressed CV store.",
+                    default = "data/cv_store")
+parser.add_argument("--no-cache",
+                    help = "Download every CV in full, even if unchanged.",
+                    action = "store_true")
+parser.add_argument("-metrics", type = str,
+                    help = "Jsonl file recording the timing of every download.")
+parser.add_argument("-replay", type = str,
+                    help = "Base url of a replay_server.py to fetch from instead of the network.")
+parser.add_argument("-profile", type = str,
+                    help = "Profile this run with cProfile or tracemalloc.",
+                    choices = ["cprofile", "tracemalloc"])
 parser.add_argument("-v", "--verbose", 
                     help = "Set logging level to DEBUG",
                     action = "store_true")
@@ -36,8 +78,14 @@ loghandler = logging.StreamHandler(sys.stderr)
 loghandler.setFormatter(logging.Formatter("[%(asctime)s %(message)s]"))
 log.addHandler(loghandler)
 
+store = cv_store.CVStore(args.storedir)
+metrics.configure(args.metrics, {"cvs": args.profile} if args.profile else None)
+scheduler.configure(rate = args.rate, burst = max(1, int(args.rate)),
+                    concurrency = args.workers)
+session = (replay_server.make_session(args.workers, args.replay) if args.replay
+           else scheduler.make_session(args.workers))
+
 
-user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/72.0.3626.109 Safari/537.36"
 
 
 
@@ -50,41 +98,86 @@ def download_cv(name, url):
     name (str, name of the junior faculty)
     url (str, url of the professor's CV)
     """
-    r = requests.get(url, headers={
-            'Accept': 'text/html; charset=iso-8859-1',
-            'User-Agent': user_agent}) 
-    filename = name.replace(" ", "").replace(".", "")
-    
-    # save meta information in json
-    with open(os.path.join(args.cvdir, filename + ".json"), "w") as j:
-        json.dump(dict(r.headers), j)
-    if r.status_code != 200:
-        r.raise_for_status()
-    else:
-        if url.endswith(".pdf"):
-            with open(os.path.join(args.cvdir, filename + ".pdf"), "wb") as f:
-                f.write(r.content)
-        # if not downloadable, write message
-        if url.endswith(".html"):
-            with open(os.path.join(args.cvdir, filename + ".html"), "w") as h:
-                h.write(r.text)
-        log.info("CV accessed for {}".format(name))
+    download.download_cv(name, url, args.cvdir, session,
+                         revalidate = not args.no_cache, store = store)
     
 
 
+def read_manifest(manifest):
+    """
+    Read the (name, url) pairs of a batch download.
+    --------
+    manifest (str, .csv with a header or .jsonl with name and url)
+    """
+    with open(manifest, newline = "") as f:
+        if manifest.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["name"], row["url"]) for row in rows if row.get("url")]
+
+
+def download_batch(pairs):
+    """
+    Download every CV in `pairs` through the scheduled session, with
+    at most `args.per_host` downloads running against any one host,
+    and write one result line per CV to `args.results`.
+    --------
+    pairs (list, (name, url) of each CV)
+    """
+    host_limits = defaultdict(lambda: threading.Semaphore(args.per_host))
+    lock = threading.Lock()
+
+    def fetch(name, url):
+        with lock:
+            limit = host_limits[urlparse(url).netloc]
+        with limit:
+            start = time.time()
+            result = {"name": name, "url": url}
+            try:
+                r = download.download_cv(name, url, args.cvdir, session,
+                                         revalidate = not args.no_cache,
+                                         store = store)
+                result["status"] = r.status_code
+                _, target = download.cv_path(args.cvdir, name, url)
+                if r.status_code == 200:
+                    result["bytes"] = os.path.getsize(target)
+                elif r.status_code == 206:
+                    result["bytes"] = int(r.headers.get("content-length", 0))
+                else:
+                    result["bytes"] = 0
+                result["file"] = target
+            except requests.exceptions.RequestException as e:
+                result["status"] = getattr(e.response, "status_code", None)
+                result["bytes"] = 0
+                result["error"] = str(e)
+            result["seconds"] = round(time.time() - start, 3)
+            return result
+
+    with ThreadPoolExecutor(max_workers = args.workers) as pool, \
+         open(args.results, "w") as out:
+        futures = [pool.submit(fetch, name, url) for name, url in pairs]
+        for future in as_completed(futures):
+            result = future.result()
+            log.info("{}: {} ({} bytes)".format(result["name"], result["status"],
+                                                result["bytes"]))
+            out.write(json.dumps(result) + "\n")
+
+
 if __name__ == "__main__":
     
-    files = [file for file in os.listdir(args.namesdir) if file.endswith(".json")]
-    for file in files:
-        with open(os.path.join(args.namesdir, file), "r") as f:
-            names = json.load(f)
-        for name in names:
-            if re.search("people", name, re.IGNORECASE):
-                continue
+    if args.manifest:
+        with metrics.stage("cvs"):
+            download_batch(read_manifest(args.manifest))
+        sys.exit()
+    
+    for _, _, name in roster_store.open_store(args.rosters, args.namesdir).roster():
+        if re.search("people", name, re.IGNORECASE):
+            continue
+        else:
+            input_url = str(input("Enter url for {}. If none, enter 'none': ".format(name)))
+            if input_url != 'none':
+                download_cv(name, input_url)
             else:
-                input_url = str(input("Enter url for {}. If none, enter 'none': ".format(name)))
-                if input_url != 'none':
-                    download_cv(name, input_url)
-                else:
-                    log.info("Unable to find stand alone CV")
+                log.info("Unable to find stand alone CV")
     sys.exit()
\ No newline at end of file
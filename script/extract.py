@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+lxml backend for the parsers in get_junior_faculty.py. The page is
+parsed once and walked once in document order, remembering the last
+heading/anchor seen, so each title resolves to its name without the
+backward find_previous() walk BeautifulSoup does for every match.
+The helpers reproduce bs4's `.string`, `.stripped_strings`,
+`find_previous` and `find_parent` so rosters come out the same.
+The parser of each school is a Site compiled once from its entry in
+data/site_specs.json, so a new department is a new entry there.
+Site.stream() reads the same names off a page without keeping its
+tree, for directories too large to parse whole.
+Run as a script to stream the (name, title) pairs of saved pages:
+    python script/extract.py "DUKE UNIVERSITY" data/faculty_page/DUKE*.html
+"""
+import re
+import json
+from html import unescape
+from lxml import etree
+
+
+html_parser = etree.HTMLParser()
+
+# text inside these tags is not part of bs4's stripped_strings
+skip_tags = {"script", "style", "template"}
+
+heading = re.compile("^h")
+
+harvard_next = etree.XPath(
+    '(.//ul[contains(concat(" ", normalize-space(@class), " "), " pager ")])[1]'
+    '//li[contains(concat(" ", normalize-space(@class), " "), " pager-next ")]')
+princeton_next = etree.XPath(
+    './/li[normalize-space(@class) = "pager__item pager__item--next"]')
+pager_next = etree.XPath(
+    './/li[contains(concat(" ", normalize-space(@class), " "), " pager-next ")]')
+first_href = etree.XPath('(.//a[@href])[1]/@href')
+
+# pager links read off the raw html, before the page is parsed
+pager_next_link = re.compile(
+    r'<li class="pager(?:-next|__item pager__item--next)[^"]*">\s*<a\b[^>]*?\bhref="([^"]*)"')
+pager_last_link = re.compile(
+    r'<li class="pager(?:-last|__item pager__item--last)[^"]*">\s*<a\b[^>]*?\bhref="([^"]*)"')
+pager_count = re.compile(r'<li class="pager-current[^"]*">\s*\d+ of (\d+)\s*</li>')
+page_number = re.compile(r"\bpage=(\d+)")
+
+
+def roots(html, tag = "body"):
+    """
+    Parse the page once and return the outermost `tag` elements,
+    which is what SoupStrainer(tag) keeps.
+    --------
+    html (str, html content)
+    tag (str, tag the parse is limited to)
+    """
+    doc = etree.fromstring(html, html_parser)
+    if doc is None:
+        return []
+    return doc.xpath("//{0}[not(ancestor::{0})]".format(tag))
+
+
+def walk(roots):
+    """
+    Yield ("tag", element, parent) when an element opens and
+    ("string", text, parent) or ("comment", text, parent) for every
+    text node, in the order bs4 lists previous_elements.
+    --------
+    roots (list, elements to walk)
+    """
+    for root in roots:
+        for event, el in etree.iterwalk(root, events = ("start", "end")):
+            if event == "start":
+                if isinstance(el.tag, str):
+                    yield "tag", el, el.getparent()
+                    if el.text:
+                        yield "string", el.text, el
+                elif el.tag is etree.Comment and el.text is not None:
+                    yield "comment", el.text, el.getparent()
+            elif el is not root and el.tail:
+                yield "string", el.tail, el.getparent()
+
+
+def string(el):
+    """
+    bs4's Tag.string: the only string below `el` or None.
+    --------
+    el (lxml element)
+    """
+    while el is not None:
+        if not isinstance(el.tag, str):
+            return el.text
+        children = (1 if el.text else 0) + len(el) + sum(1 for c in el if c.tail)
+        if children != 1:
+            return None
+        if el.text:
+            return el.text
+        el = el[0]
+    return None
+
+
+def stripped_strings(el):
+    """
+    bs4's Tag.stripped_strings as a list.
+    --------
+    el (lxml element)
+    """
+    return [text.strip() for kind, text, parent in walk([el])
+            if kind == "string" and parent.tag not in skip_tags
+            and text.strip()]
+
+
+def find(el, tag):
+    """
+    First element named `tag` below `el`, or None.
+    --------
+    el (lxml element)
+    tag (str, tag name)
+    """
+    return next(el.iterdescendants(tag), None)
+
+
+def find_parent(el, tag):
+    """
+    `el` or its closest ancestor named `tag`, or None.
+    --------
+    el (lxml element, parent of the matched string)
+    tag (str, tag name)
+    """
+    while el is not None and el.tag != tag:
+        el = el.getparent()
+    return el
+
+
+def previous(roots, pattern, match = None):
+    """
+    For each string matching `pattern`, the last element opened
+    before it that satisfies `match`, with the string's parent and
+    the string itself.
+    --------
+    roots (list, elements to walk)
+    pattern (compiled regex for the title)
+    match (function, element -> bool, default keeps no element)
+    """
+    last = None
+    found = []
+    for kind, node, parent in walk(roots):
+        if kind == "tag":
+            if match is not None and match(node):
+                last = node
+        # bs4 matches comments against the title pattern as well
+        elif pattern.search(node):
+            found.append((last, parent, node))
+    return found
+
+
+def title_text(text):
+    """
+    Title as recorded next to a name, its whitespace collapsed.
+    --------
+    text (str, text node holding the title)
+    """
+    return " ".join(text.split())
+
+
+def is_heading(el):
+    return heading.search(el.tag) is not None
+
+
+def next_href(roots, xpath):
+    """
+    href of the first link in the first pager item found by `xpath`,
+    None if there is no such item.
+    --------
+    roots (list, elements to search)
+    xpath (compiled XPath for the pager item)
+    """
+    for root in roots:
+        for li in xpath(root):
+            href = first_href(li)
+            return href[0] if href else None
+    return None
+
+
+def pages_ahead(html):
+    """
+    hrefs of the pages after this one, read off the pager with
+    regular expressions instead of a parse. All of them when the pager
+    shows the last page ("last" link or "1 of 4"), else the next one.
+    --------
+    html (str, html content)
+    """
+    match = pager_next_link.search(html)
+    if match is None:
+        return []
+    href = unescape(match.group(1))
+    first = page_number.search(href)
+    last = None
+    match = pager_last_link.search(html)
+    if match is not None:
+        number = page_number.search(unescape(match.group(1)))
+        last = int(number.group(1)) if number else None
+    else:
+        match = pager_count.search(html)
+        last = int(match.group(1)) - 1 if match else None
+    if first is None or last is None:
+        return [href]
+    return [page_number.sub("page={}".format(n), href)
+            for n in range(int(first.group(1)), last + 1)]
+
+
+pagers = {"harvard": harvard_next, "princeton": princeton_next, "next": pager_next}
+
+# the pagers for Stream, tried on each ul/li as it closes: the
+# element holding the pager and, inside it, the item linking onwards
+class_has = 'contains(concat(" ", normalize-space(@class), " "), " {} ")'.format
+stream_pagers = {
+    "harvard": (etree.XPath("self::ul[{}]".format(class_has("pager"))),
+                etree.XPath(".//li[{}]".format(class_has("pager-next")))),
+    "princeton": (etree.XPath('self::li[normalize-space(@class) = "pager__item pager__item--next"]'),
+                  etree.XPath("self::li")),
+    "next": (etree.XPath("self::li[{}]".format(class_has("pager-next"))),
+             etree.XPath("self::li"))}
+
+
+class Site:
+    """
+    Extractor compiled from the spec of one school in
+    data/site_specs.json. The keys of a spec are
+    - root: tag the parse is limited to (default "body"),
+    - previous: "heading" or a list of tags, the last element of which
+      opened before a title holds the name,
+    - name: "string" or "strings" of that element, or "cell" for the
+      cell number `cell` of the title's table row, its link if `link`,
+      left out when empty if `skip_missing`,
+    - title_tag: tag whose only string is the title, for pages where
+      the names are read off those tags instead of every text node,
+    - pager: "harvard", "princeton" or "next", the pager of paginated
+      pages, and next_base: "url" if its links are relative to the
+      first page, "" if they are relative to the site,
+    - profiles: {"links", "base_url", "title"} for schools whose titles
+      are only on the profile pages: the XPath of the profile links,
+      the url they are relative to and the title reader to use.
+    A spec without `name` or `profiles` has no parser.
+    --------
+    school (str, name of the school)
+    spec (dict, entry of the specs)
+    """
+
+    def __init__(self, school, spec):
+        self.school = school
+        self.spec = spec
+        self.root = spec.get("root", "body")
+        self.previous = spec.get("previous")
+        if self.previous == "heading":
+            self.match = is_heading
+        elif self.previous:
+            tags = set(self.previous)
+            self.match = lambda el: el.tag in tags
+        else:
+            self.match = None
+        self.name = spec.get("name")
+        self.cell = spec.get("cell", 0)
+        self.link = spec.get("link", False)
+        self.skip_missing = spec.get("skip_missing", False)
+        self.title_tag = spec.get("title_tag")
+        self.pager = spec.get("pager")
+        self.pager_xpath = pagers[self.pager] if self.pager else None
+        self.next_base = spec.get("next_base", "url")
+        self.profiles = spec.get("profiles")
+        self.profile_links = etree.XPath(self.profiles["links"]) if self.profiles else None
+
+    def parses(self):
+        return self.name is not None or self.profiles is not None
+
+    def names(self, html, pattern):
+        """
+        (name, title) of the titles matching `pattern` and the href of
+        the next page (None on the last page or without a pager). The
+        titles are the text as found, before title_text(), since
+        ranks.junior reads the whitespace around them.
+        --------
+        html (str, html content)
+        pattern (object with a search method, e.g. ranks.junior)
+        """
+        body = roots(html, self.root)
+        list_ = []
+        if self.title_tag:
+            last = None
+            for kind, node, _ in walk(body):
+                if kind != "tag":
+                    continue
+                if node.tag == self.title_tag:
+                    title = string(node)
+                    if title is not None and pattern.search(title):
+                        list_.append((string(last), title))
+                elif self.match(node) and string(node) is not None:
+                    last = node
+        else:
+            for el, parent, title in previous(body, pattern, self.match):
+                if self.name == "cell":
+                    tr = find_parent(parent, "tr")
+                    cells = list(tr.iterdescendants("td")) if tr is not None else []
+                    # a rank mentioned outside the table or in a short row
+                    if len(cells) <= self.cell:
+                        continue
+                    td = cells[self.cell]
+                    name = string(find(td, "a") if self.link else td)
+                    if name is None and self.skip_missing:
+                        continue
+                    list_.append((name, title))
+                elif self.name == "strings":
+                    list_.extend((name, title) for name in stripped_strings(el))
+                else:
+                    list_.append((string(el), title))
+        return list_, next_href(body, self.pager_xpath) if self.pager else None
+
+    def stream(self, source, pattern):
+        """
+        ([(name, title)], href of the next page or None) of the page,
+        read without building its tree; see Stream.
+        --------
+        source (str or file, path or binary file of the html)
+        pattern (object with a search method, e.g. ranks.junior)
+        """
+        return Stream(self, pattern).read(source)
+
+    def links(self, html):
+        """
+        (link element, absolute url) of every profile linked from the
+        page.
+        --------
+        html (str, html content)
+        """
+        doc = etree.fromstring(html, html_parser)
+        if doc is None:
+            return []
+        return [(a, self.profiles["base_url"] + a.get("href"))
+                for a in self.profile_links(doc)]
+
+
+kept_attributes = ("class", "href")
+
+
+class Stream:
+    """
+    Parser target reading the (name, title) pairs of a page as the
+    elements holding them close, without keeping the page's tree.
+    libxml2 hands the elements to a TreeBuilder as it reads them, and
+    only the elements a name may still be read from are kept whole:
+    the open heading or tag named by the spec's `previous`, the open
+    table row of "cell" specs, the open title tag and the open pager.
+    Every other element is cleared when it closes and dropped with its
+    earlier siblings, so memory stays bounded by the largest such
+    element rather than by the page.
+    The page is read with a plain parse rather than iterparse or
+    HTMLPullParser: libxml2 holds the whole input of an incremental
+    html parse, but frees what it has read otherwise.
+    The pairs and the pager link are those Site.names() reads off the
+    whole tree.
+    --------
+    site (Site, compiled spec of the school)
+    pattern (object with a search method, e.g. ranks.junior)
+    """
+
+    def __init__(self, site, pattern):
+        self.site = site
+        self.pattern = pattern
+        self.builder = etree.TreeBuilder()
+        self.pager = stream_pagers.get(site.pager)
+        self.pairs = []
+        self.href = None
+        self.pager_found = False
+        self.inside = None
+        self.kept = []
+        self.last, self.last_names = None, [None]
+        # titles waiting for the element holding their name to close,
+        # in document order: [element or None, names, title]
+        self.waiting = []
+        # the text node complete at the next event, (element, "text" or "tail")
+        self.pending = None
+
+    def read(self, source):
+        """
+        ([(name, title)], href of the next page or None) of a page.
+        --------
+        source (str or file, path or binary file of the html)
+        """
+        return etree.parse(source, etree.HTMLParser(target = self, encoding = "utf-8"))
+
+    def keep(self, el):
+        site = self.site
+        if site.name == "cell" and el.tag == "tr":
+            return True
+        if el.tag == site.title_tag or (site.match is not None and site.match(el)):
+            return True
+        return (self.pager is not None and el.tag in ("ul", "li")
+                and "pager" in el.get("class", ""))
+
+    def names(self, el):
+        """
+        Names read off `el`, the closed element named by `previous`.
+        """
+        if self.site.name == "strings":
+            return stripped_strings(el)
+        return [string(el)]
+
+    def cell(self, tr):
+        """
+        Name in the spec's cell of the closed table row `tr`, [] if
+        the row is too short for it, or if it is empty and the spec
+        skips missing names.
+        """
+        site = self.site
+        cells = list(tr.iterdescendants("td"))
+        if len(cells) <= site.cell:
+            return []
+        td = cells[site.cell]
+        name = string(find(td, "a") if site.link else td)
+        return [] if name is None and site.skip_missing else [name]
+
+    def title(self, text, parent):
+        if not self.pattern.search(text):
+            return
+        if self.site.name == "cell":
+            tr = find_parent(parent, "tr")
+            if tr is not None:
+                self.waiting.append([tr, None, text])
+        elif self.last is not None and self.last_names is None:
+            # the title is inside the element holding its name
+            self.waiting.append([self.last, None, text])
+        else:
+            self.waiting.append([None, self.last_names, text])
+
+    def flush(self):
+        # title tags are read whole as they close
+        if self.pending is None or self.inside is None or self.site.title_tag:
+            return
+        el, kind = self.pending
+        if kind == "text":
+            if el.text:
+                self.title(el.text, el)
+        elif el is not self.inside and el.tail:
+            self.title(el.tail, el.getparent())
+
+    def start(self, tag, attrib):
+        site = self.site
+        # the pagers only read these, and TreeBuilder refuses some
+        # attribute names libxml2 lets through, e.g. "xml:lang"
+        el = self.builder.start(tag, {name: attrib[name] for name in kept_attributes
+                                      if name in attrib})
+        self.flush()
+        self.pending = (el, "text")
+        if self.inside is None and tag == site.root:
+            self.inside = el
+        self.kept.append(self.inside is not None and self.keep(el))
+        if (self.inside is not None and not site.title_tag
+                and site.match is not None and site.match(el)):
+            self.last, self.last_names = el, None
+
+    def end(self, tag):
+        site = self.site
+        el = self.builder.end(tag)
+        self.flush()
+        self.pending = (el, "tail")
+        if self.inside is not None:
+            if self.pager is not None and not self.pager_found \
+                    and el.tag in ("ul", "li") and self.pager[0](el):
+                self.pager_found = True
+                items = self.pager[1](el)
+                href = first_href(items[0]) if items else None
+                self.href = href[0] if href else None
+            if site.title_tag:
+                if el.tag == site.title_tag:
+                    text = string(el)
+                    if text is not None and self.pattern.search(text):
+                        self.waiting.append([None, self.last_names, text])
+                elif site.match(el) and string(el) is not None:
+                    self.last_names = [string(el)]
+            elif el is self.last:
+                self.last_names = self.names(el)
+            for entry in self.waiting:
+                if entry[0] is el:
+                    entry[0], entry[1] = None, (self.cell(el) if site.name == "cell"
+                                                else self.last_names)
+            while self.waiting and self.waiting[0][0] is None:
+                _, names, text = self.waiting.pop(0)
+                self.pairs.extend((name, text) for name in names)
+        if el is self.inside:
+            self.inside = None
+        self.kept.pop()
+        if not any(self.kept):
+            el.clear(keep_tail = True)
+            parent = el.getparent()
+            while parent is not None and el.getprevious() is not None:
+                del parent[0]
+
+    def data(self, data):
+        self.builder.data(data)
+
+    def comment(self, text):
+        el = self.builder.comment(text)
+        self.flush()
+        # bs4 matches comments against the title pattern as well
+        if self.inside is not None and text is not None and not self.site.title_tag:
+            self.title(text, el.getparent())
+        self.pending = (el, "tail")
+
+    def close(self):
+        self.flush()
+        for _, names, text in self.waiting:
+            self.pairs.extend((name, text) for name in names or ())
+        self.builder.close()
+        return self.pairs, self.href
+
+
+def load_sites(path):
+    """
+    {school: Site} compiled from the specs in the json file `path`.
+    --------
+    path (str, json file of the specs)
+    """
+    with open(path) as j:
+        return {school: Site(school, spec) for school, spec in json.load(j).items()}
+
+
+if __name__ == "__main__":
+
+    # stream the (name, title) pairs of saved pages of one school
+    import sys
+    import ranks
+
+    site = load_sites("data/site_specs.json")[sys.argv[1]]
+    for file in sys.argv[2:]:
+        pairs, href = site.stream(file, ranks.junior)
+        for name, title in pairs:
+            print("{}\t{}".format(name, title_text(title)))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Extract the text of every CV in data/faculty_cv so publications can
+be counted. CVs are added to the content-addressed store first and
+the text is saved next to their hash, as text/<aa>/<sha256>.txt in
+the store, so a CV whose bytes did not change is never extracted
+again and identical CVs are extracted once. Extraction runs across a
+process pool. PDF extraction needs pdfminer.six.
+"""
+import sys
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bs4 import BeautifulSoup
+import cv_store
+import metrics
+
+
+# set argument parser
+parser = argparse.ArgumentParser(description='Extract the text of the CVs.')
+parser.add_argument("-cvdir", type = str,
+                    help = "Directory storing the CVs.",
+                    default = "data/faculty_cv")
+parser.add_argument("-storedir", type = str,
+                    help = "Directory of the content-addressed CV store.",
+                    default = "data/cv_store")
+parser.add_argument("-workers", type = int,
+                    help = "Number of CVs extracted at the same time.",
+                    default = os.cpu_count())
+parser.add_argument("-v", "--verbose",
+                    help = "Set logging level to DEBUG.",
+                    action = "store_true")
+args = parser.parse_args(None if __name__ == "__main__" else [])
+
+
+# set logging
+log = logging.getLogger(__name__)
+log.setLevel(logging.ERROR)
+if args.verbose:
+    log.setLevel(logging.DEBUG)
+loghandler = logging.StreamHandler(sys.stderr)
+loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+log.addHandler(loghandler)
+
+
+def text_path(store, sha256):
+    """
+    Where the text of the CV with hash `sha256` is saved.
+    --------
+    store (cv_store.CVStore)
+    sha256 (str, hash of the CV)
+    """
+    return os.path.join(store.root, "text", sha256[:2], sha256 + ".txt")
+
+
+def extract(source, target):
+    """
+    Extract the text of one CV and save it. Runs in a worker process.
+    The format is read from the bytes because some .pdf files are
+    html error pages.
+    --------
+    source (str, CV file)
+    target (str, text file to write)
+    """
+    with open(source, "rb") as f:
+        is_pdf = f.read(1024).lstrip().startswith(b"%PDF")
+    if is_pdf:
+        from pdfminer.high_level import extract_text
+        text = extract_text(source)
+    else:
+        with open(source, "rb") as f:
+            text = BeautifulSoup(f.read(), "lxml").get_text("\n")
+    os.makedirs(os.path.dirname(target), exist_ok = True)
+    with open(target + ".tmp", "w") as t:
+        t.write(text)
+    os.replace(target + ".tmp", target)
+    return len(text)
+
+
+def extract_all(store, cvdir):
+    """
+    Add the CVs in `cvdir` to the store and extract the text of
+    every distinct CV that has none yet. Returns {file name: sha256}.
+    --------
+    store (cv_store.CVStore)
+    cvdir (str, directory storing the CVs)
+    """
+    hashes = {}
+    for file in sorted(os.listdir(cvdir)):
+        key, ext = os.path.splitext(file)
+        if ext not in cv_store.cv_extensions or file.startswith("."):
+            continue
+        hashes[key], _ = store.add(key, os.path.join(cvdir, file))
+
+    todo = {sha256 for sha256 in hashes.values()
+            if not os.path.exists(text_path(store, sha256))}
+    log.info("{} CVs, {} distinct, {} to extract".format(
+        len(hashes), len(set(hashes.values())), len(todo)))
+    with ProcessPoolExecutor(max_workers = args.workers) as pool:
+        futures = {pool.submit(extract, store.object_path(sha256),
+                               text_path(store, sha256)): sha256
+                   for sha256 in todo}
+        for future in as_completed(futures):
+            try:
+                log.info("{}: {} characters".format(futures[future][:12],
+                                                    future.result()))
+            except Exception as e:
+                log.error("Unable to extract {}: {}".format(futures[future][:12], e))
+    return hashes
+
+
+if __name__ == "__main__":
+
+    store = cv_store.CVStore(args.storedir)
+    with metrics.stage("text"):
+        extract_all(store, args.cvdir)
+
+    sys.exit()
@@ -14,6 +14,18 @@ import os
 from bs4 import BeautifulSoup, SoupStrainer, NavigableString
 import re
 import json
+import hashlib
+import time
+import functools
+import http_cache
+import metrics
+import scheduler
+import replay_server
+import extract
+import profiles
+import roster_store
+import ranks
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
 
 
@@ -26,12 +38,63 @@ parser.add_argument("-pagedir", type = str,
 parser.add_argument("-parsedir", type = str,
                     help = "Directory to store output of this file.",
                     default = "data/faculty_names")
+parser.add_argument("-ranksdir", type = str,
+                    help = "Directory to store the name and rank of everyone with a rank.",
+                    default = "data/faculty_ranks")
+parser.add_argument("-rosters", type = str,
+                    help = "SQLite roster store the rosters of the crawl are added to.",
+                    default = "data/rosters.sqlite")
+parser.add_argument("-specs", type = str,
+                    help = "Json file of the page layout of each school.",
+                    default = "data/site_specs.json")
+parser.add_argument("-diffs", type = str,
+                    help = "Jsonl file the roster changes of each crawled school are added to.",
+                    default = "data/roster_diffs.jsonl")
 parser.add_argument("-school", type = str,
                     help = "Name of the school.")
+parser.add_argument("-cachedir", type = str,
+                    help = "Directory storing the HTTP cache.",
+                    default = "data/http_cache")
+parser.add_argument("--no-cache",
+                    help = "Fetch every page in full.",
+                    action = "store_true")
+parser.add_argument("-profilecache", type = str,
+                    help = "Json file caching titles read from profile pages.",
+                    default = "data/profile_cache.json")
+parser.add_argument("-profile-ttl", type = float,
+                    help = "Days a cached profile title stays valid.",
+                    default = 30)
+parser.add_argument("-workers", type = int,
+                    help = "Number of pages fetched at the same time.",
+                    default = 8)
+parser.add_argument("-rate", type = float,
+                    help = "Requests per second to one host.",
+                    default = 2)
+parser.add_argument("--concurrent",
+                    help = "Fetch the first page of every school in parallel.",
+                    action = "store_true")
+parser.add_argument("-backend", type = str,
+                    help = "HTML parsing backend, stream reading the page without building its tree.",
+                    choices = ["lxml", "bs4", "stream"],
+                    default = "lxml")
+parser.add_argument("--offline",
+                    help = "Re-parse the pages saved in pagedir without fetching.",
+                    action = "store_true")
+parser.add_argument("--no-record",
+                    help = "Do not record what each page gave, for reuse by the next crawl.",
+                    action = "store_true")
+parser.add_argument("-metrics", type = str,
+                    help = "Jsonl file recording the timing of every fetch and parse.")
+parser.add_argument("-replay", type = str,
+                    help = "Base url of a replay_server.py to fetch from instead of the network.")
+parser.add_argument("-profile", type = str,
+                    help = "Profile this run with cProfile or tracemalloc.",
+                    choices = ["cprofile", "tracemalloc"])
 parser.add_argument("-v", "--verbose", 
                     help = "Set logging level to DEBUG.",
                     action = "store_true")
-args = parser.parse_args()
+# use the defaults when imported by another script
+args = parser.parse_args(None if __name__ == "__main__" else [])
 
 
 # set logging
@@ -46,6 +109,46 @@ log.addHandler(loghandler)
 
 """ STEP 0 """
 
+# the crawl and the offline reparse are separate stages of the pipeline
+stage = "rosters" if args.offline else "pages"
+metrics.configure(args.metrics, {stage: args.profile} if args.profile else None)
+scheduler.configure(rate = args.rate, burst = max(1, int(args.rate)),
+                    concurrency = args.workers)
+session = (replay_server.make_session(args.workers, args.replay) if args.replay
+           else scheduler.make_session(args.workers))
+cache = None if args.no_cache else http_cache.HTTPCache(args.cachedir)
+profile_cache = profiles.ProfileCache(args.profilecache, args.profile_ttl * 24 * 3600)
+
+
+def page_path(school, count = 0):
+    """
+    Path of a saved faculty page, without its extension.
+    --------
+    school (str, name of the school)
+    count (int, page count, default is 0)
+    """
+    filename = "{}_faculty_page".format(school.replace(" ", "_"))
+    return os.path.join(args.pagedir, filename + str(count))
+
+
+def page_hash(html):
+    return hashlib.sha1(html.encode("utf-8")).hexdigest()
+
+
+def saved_hash(path):
+    """
+    sha1 of the page saved at `path`, from its sidecar or, for pages
+    saved before the sidecars held it, from the page itself.
+    --------
+    path (str, saved page without its extension)
+    """
+    sha1 = http_cache.read_sidecar(path + ".json").get("sha1")
+    if sha1 is None:
+        with open(path + ".html", newline = "") as h:
+            sha1 = page_hash(h.read())
+    return sha1
+
+
 def get_html(school, url, count = 0):
     """
     Open the faculty page of polisci/govt department and
@@ -55,369 +158,578 @@ def get_html(school, url, count = 0):
     url (str, url to the faculty page)
     count (int, page count, default is 0)
     """
+    return save_html(school, fetch_html(school, url, count), count)
 
-    r = requests.get(url)
+
+def fetch_html(school, url, count = 0):
+    """
+    Response for a faculty page, without saving it.
+    --------
+    school (str, name of the school)
+    url (str, url to the faculty page)
+    count (int, page count, default is 0)
+    """
+    path = page_path(school, count)
+    if cache is not None:
+        r = cache.get(session, url, path + ".html", path + ".json")
+    else:
+        r = session.get(url)
     log.info("Server response for {}: {}".format(school, r.status_code))
-    filename = "{}_faculty_page".format(school.replace(" ", "_"))
+    return r
+
+
+def save_html(school, r, count = 0):
+    """
+    Save a fetched faculty page and its request headers, and return
+    its html. Error responses are not saved and give None.
+    --------
+    school (str, name of the school)
+    r (requests.Response, response from fetch_html())
+    count (int, page count, default is 0)
+    """
+    if not r.ok:
+        log.error("Unable to fetch page {} of {}: {}".format(count, school, r.status_code))
+        return None
+
+    path = page_path(school, count)
+    # the saved copy is still current, whether or not the server said so
+    sha1 = page_hash(r.text)
+    if os.path.exists(path + ".html") and saved_hash(path) == sha1:
+        log.info("Not modified since last crawl: {}".format(school))
+        return r.text
     
     # save html content to file
-    with open(os.path.join(args.pagedir, filename + str(count) + ".html"), "w") as h:
+    with open(path + ".html", "w") as h:
         h.write(r.text)
         
     # save HTTP requests header to file
-    with open(os.path.join(args.pagedir, filename + str(count) + ".json"), "w") as t:
+    with open(path + ".json", "w") as t:
         try:
             header = {"date": r.headers['date'],
                  "content-type": r.headers['content-type'],
-                 "last modified": r.headers['last-modified']}
+                 "last modified": r.headers['last-modified'],
+                 "etag": r.headers.get('etag')}
         except KeyError:
             header = {"date": None, 
                       "content-type": None,
-                      "last-modified" : None}
+                      "last modified" : None,
+                      "etag": r.headers.get('etag')}
+        header["sha1"] = sha1
         json.dump(header, t)
     
     return r.text
 
 
+def page_source(count = 0):
+    """
+    What the stream backend reads page `count` of `args.school` from:
+    the copy get_html() saved, not a second one in memory.
+    --------
+    count (int, page count, default is 0)
+    """
+    return page_path(args.school, count) + ".html"
+
+
+def read_html(school, url, count = 0):
+    """
+    Read a faculty page saved by get_html() instead of fetching it.
+    Returns None if the page was never saved.
+    --------
+    school (str, name of the school)
+    url (str, url to the faculty page, unused)
+    count (int, page count, default is 0)
+    """
+    path = page_path(school, count) + ".html"
+    if not os.path.exists(path):
+        log.info("No saved page {} for {}".format(count, school))
+        return None
+    with open(path) as h:
+        return h.read()
+
+
 """
 STEP 1: Parse html files
 """
 
 
-# title pattern
-title_pattern = re.compile("Assistant\s(?=Professor)|(?<!Adjunct)\sAssociate\s(?=Professor)|Assistant\s(?=Teaching\sProfessor)")
+# titles of every rank, read by ranks.py and usable wherever a title
+# pattern is expected; the junior faculty are picked out of them
+ranked_titles = ranks.ranked
 
 
+# names saved by the parser being measured
+saved = []
 
-# harvard university, princeton university
 
-def parse_school0(html, count = 0):
+def save_roster(filename, list_):
     """
-    Parse the html of the faculty page html returned from 
-    get_faculty_page.py and create a roster of junior faculty
-    members (assistant and associates). Must check whether there's a 
-    next page. 
+    Save the junior faculty of a page to `args.parsedir`.
     --------
-    html_file (name of the html file to parse)
+    filename (str, name of the json file)
+    list_ (list, names of the junior faculty)
     """
-
-    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("body"))
-    
-    
-    # get the names of associate/assistant professors
-    list_ = []
-    for string in soup.find_all(string = title_pattern):
-        h = string.find_previous(re.compile("^h"))
-        for string in h.stripped_strings:
-            list_.append(string)
-    log.info("Junior faculty: \n {}".format(list_))
-    
-    # save to file
-    filename = args.school.replace(" ", "_") + str(count) + ".json"
+    saved.append(len(list_))
     with open(os.path.join(args.parsedir, filename), "w") as j:
         json.dump(list_, j)
-    
-    
-    # check if there's a next page
-    if args.school == 'HARVARD UNIVERSITY':
-        li = soup.find("ul", {"class": "pager"}).find("li", {"class": "pager-next"})
-        if li.find("a", href = True) != None:
-            href = li.find("a", href = True)["href"]
-            log.info("Next url for HARVARD is {}".format(href))
-            return href
-        else:
-            log.info("Reached last page")
-            return None
-    if args.school == 'PRINCETON UNIVERSITY':
-        if soup.find("li", {"class": "pager__item pager__item--next"}):
-            li = soup.find("li", {"class": "pager__item pager__item--next"})
-            href = url + li.find("a", href = True)["href"]
-            log.info("Next url for PRINCETON is {}".format(href))
-            return href
-        else:
-            log.info("Reached last page")
-            return None
-        
 
-# stanford university, mit, columbia university, penn state u, 
-# u washington, wisconsin-madison
-        
-def parse_school1(html):
+
+def save_ranks(filename, ranked):
     """
-    Similar to get_juniof_faculty(html_file) but does not have
-    multiple pages to parse.
-    -----
-    html_file (str, name of the html file to parse)
+    Save the name and rank of everyone with a rank on a page to
+    `args.ranksdir`.
+    --------
+    filename (str, name of the json file)
+    ranked (list, (name, rank) of the faculty)
     """
-    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("body"))
-    
-    # get the names of associate/assistant professors
-    list_ = []
-    for string in soup.find_all(string = title_pattern):
-        if string.find_previous(re.compile("^h")).find(re.compile("a|span")):
-            h = string.find_previous(re.compile("^h"))
-            list_.append(h.string)
-        else:
-            h = string.find_previous(re.compile("^h"))
-            list_.append(h.string)
-    log.info("Junior faculty: \n {}".format(list_))
-    
-    # save to file
-    filename = args.school.replace(" ", "_") + ".json"
-    with open(os.path.join(args.parsedir, filename), "w") as j:
-        json.dump(list_, j)
+    os.makedirs(args.ranksdir, exist_ok = True)
+    with open(os.path.join(args.ranksdir, filename), "w") as j:
+        json.dump(ranked, j)
 
 
-# university of north carolina, texas a & m
+def split_ranks(found):
+    """
+    (pairs, ranked) of what a parser found: the (name, title) of the
+    junior faculty and the (name, rank) of everyone with a rank, once
+    per name. Headings and other text read as a name are left out of
+    the ranks.
+    --------
+    found (list, (name, title text as found) for every ranked title)
+    """
+    pairs = []
+    found_ranks = {}
+    for name, text in found:
+        if ranks.person(name):
+            found_ranks.setdefault(name, set()).add(ranked_titles.rank(text))
+        if ranked_titles.junior(text):
+            pairs.append((name, extract.title_text(text)))
+    return pairs, [(name, ranks.person_rank(seen)) for name, seen in found_ranks.items()]
 
-def parse_school2(html):
+
+def measured(parse):
     """
-    Obtains a list of junior faculty members for faculty pages
-    with a table. 
-    ------
-    html_file (str, name of the html file to parse)
+    Record the time a parser takes and the names it saves.
+    --------
+    parse (function, one of the parse_* functions)
     """
-    
-    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("body"))
-    
-    # get the names of associate/assistant professors
-    list_ = [] 
-    for string in soup.find_all(string = title_pattern):
-        tr = string.find_parent("tr")
-        if "NORTH CAROLINA" in args.school:
-            td = tr.find_all("td")[1]
-            list_.append(td.string)
-        if "TEXAS A & M" in args.school:
-            td = tr.find_all("td")[2]
-            if td.find("a").string != None:
-                list_.append(td.find("a").string)
-    log.info("Junior faculty: \n {}".format(list_))
-    
-    # save to file
-    filename = args.school.replace(" ", "_") + ".json"
-    with open(os.path.join(args.parsedir, filename), "w") as j:
-        json.dump(list_, j)
-    
+    @functools.wraps(parse)
+    def wrapper(html, *count):
+        del saved[:]
+        start = time.perf_counter()
+        try:
+            return parse(html, *count)
+        finally:
+            metrics.record("parse", parser = parse.__name__, school = args.school,
+                           page = count[0] if count else 0,
+                           bytes = len(html.encode("utf-8")) if metrics.enabled() else None,
+                           backend = args.backend, names = sum(saved),
+                           seconds = round(time.perf_counter() - start, 4))
+    return wrapper
 
-# duke university, nyu, ucsd, chicago, illinois, vanderbilt,
-# washington u in st. louis
-    
-def parse_school3(html):
+
+
+# the bs4 equivalents of the pagers in extract.pagers
+soup_pagers = {
+    "harvard": lambda soup: soup.find("ul", {"class": "pager"}).find("li", {"class": "pager-next"}),
+    "princeton": lambda soup: soup.find("li", {"class": "pager__item pager__item--next"}),
+    "next": lambda soup: soup.find("li", {"class": "pager-next"})}
+
+
+def soup_names(site, html):
     """
-    html_file (str, name of the html file to parse)
+    bs4 version of extract.Site.names().
+    --------
+    site (extract.Site, compiled spec of the school)
+    html (str, html content)
     """
-    
-    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("body"))
-    
-    # get the names of associate/assistant professors
+    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer(site.root))
+    previous = re.compile("^h") if site.previous == "heading" else site.previous
     list_ = []
-    for string in soup.find_all(string = title_pattern):
-        a = string.find_previous("a")
-        list_.append(a.string)
-    log.info("Junior faculty: \n {}".format(list_))
-    
-    # save to file
-    filename = args.school.replace(" ", "_") + ".json"
-    with open(os.path.join(args.parsedir, filename), "w") as j:
-        json.dump(list_, j)
+    if site.title_tag:
+        for tag in soup.find_all(site.title_tag, string = ranked_titles):
+            list_.append((tag.find_previous(previous, string = True).string,
+                          str(tag.string)))
+    else:
+        for string in soup.find_all(string = ranked_titles):
+            title = str(string)
+            if site.name == "cell":
+                tr = string.find_parent("tr")
+                cells = tr.find_all("td") if tr is not None else []
+                if len(cells) <= site.cell:
+                    continue
+                td = cells[site.cell]
+                name = td.find("a").string if site.link else td.string
+                if name is None and site.skip_missing:
+                    continue
+                list_.append((name, title))
+            elif site.name == "strings":
+                list_.extend((name, title) for name
+                             in string.find_previous(previous).stripped_strings)
+            else:
+                list_.append((string.find_previous(previous).string, title))
+
+    href = None
+    if site.pager:
+        li = soup_pagers[site.pager](soup)
+        a = li.find("a", href = True) if li is not None else None
+        href = a["href"] if a is not None else None
+    return list_, href
+
+
+# (name, title) on the pages of the school being parsed, as last
+# recorded and as parsed now, and whether every page had a record
+changes = {"old": [], "new": [], "recorded": True}
+
+
+def parser_version():
+    """
+    Hash of the source of the parsers, i.e. of this file, extract.py
+    and ranks.py, and of the specs in use, so a roster is not reused
+    across a change to the parsers.
+    """
+    if not hasattr(parser_version, "version"):
+        digest = hashlib.sha1()
+        for file in (__file__, extract.__file__, ranks.__file__, args.specs):
+            with open(file, "rb") as f:
+                digest.update(f.read())
+        parser_version.version = digest.hexdigest()
+    return parser_version.version
 
 
-# uc berkeley, yale
-def parse_school4(html, count):
+def read_record(count = 0):
     """
-    Faculty members are presented in a table, but must check
-    for the next page.
-    ------
-    html_file (str, name of the html file to parse)
+    What parsing page `count` of `args.school` gave last time,
+    {"sha1", "parser", "next", "pairs", "ranks"}, or {} if it never was.
+    --------
+    count (int, page count, default is 0)
     """
-    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("body"))
-    
-    # get the names of associate/assistant professors
-    list_ = [] 
-    for string in soup.find_all(string = title_pattern):
-        if "BERKELEY" in args.school:
-            tr = string.find_parent("tr")
-            td = tr.find_all("td")[0]
-            list_.append(td.find("a").string)
-        if "YALE" in args.school:
-            list_.append(string.find_previous("a").string)
-    log.info("Junior faculty: \n {}".format(list_))
-    
-    # save to file 
-    filename = args.school.replace(" ", "_") + str(count) + ".json"
-    with open(os.path.join(args.parsedir, filename), "w") as j:
-        json.dump(list_, j)
-        
-    # check if there's next page
-    if soup.find("li", {"class": "pager-next"}):
-        li = soup.find("li", {"class": "pager-next"})
-        href = url + li.find("a", href = True)['href']
-        log.info("Next url is {}".format(href))
-        return href 
+    try:
+        with open(page_path(args.school, count) + ".roster.json") as j:
+            return json.load(j)
+    except (OSError, ValueError):
+        return {}
+
+
+def remember(count, record, html, pairs, ranked, href = None):
+    """
+    Record what parsing page `count` of `args.school` gave, next to
+    the page, and add it to `changes`.
+    --------
+    count (int, page count)
+    record (dict, previous record of the page, from read_record())
+    html (str, html content)
+    pairs (list, (name, title) of the junior faculty)
+    ranked (list, (name, rank) of the faculty)
+    href (str, url of the next page)
+    """
+    changes["old"].extend(map(tuple, record.get("pairs", [])))
+    changes["new"].extend(pairs)
+    changes["recorded"] = changes["recorded"] and bool(record)
+    if args.no_record:
+        return
+    with open(page_path(args.school, count) + ".roster.json", "w") as j:
+        json.dump({"sha1": page_hash(html), "parser": parser_version(),
+                   "next": href, "pairs": pairs, "ranks": ranked}, j)
+
+
+def roster_diff(old, new):
+    """
+    People added, removed and retitled from the (name, title) pairs
+    `old` to `new`, names compared as in roster_store.py.
+    --------
+    old (list, (name, title) as last recorded)
+    new (list, (name, title) as parsed now)
+    """
+    before = {roster_store.normalize(name): (name.strip(), title)
+              for name, title in old if name and name.strip()}
+    after = {roster_store.normalize(name): (name.strip(), title)
+             for name, title in new if name and name.strip()}
+    return {"added": [after[key] for key in after if key not in before],
+            "removed": [before[key] for key in before if key not in after],
+            "retitled": [(after[key][0], before[key][1], after[key][1]) for key in after
+                         if key in before and before[key][1] != after[key][1]]}
+
+
+@measured
+def parse_page(html, count = 0):
+    """
+    Parse a faculty page with the extractor compiled from the spec
+    of `args.school`, save its junior faculty and the rank of all its
+    faculty, and return the url of
+    the next page, None on the last page or if there is no pager.
+    A crawled page identical to the one last parsed, by the same
+    parsers, keeps the roster saved then.
+    --------
+    html (str, html content)
+    count (int, page count, default is 0)
+    """
+    site = sites[args.school]
+    filename = args.school.replace(" ", "_") + (str(count) if site.pager else "") + ".json"
+    record = read_record(count)
+    if (not args.offline and record.get("sha1") == page_hash(html)
+            and record.get("parser") == parser_version()
+            and os.path.exists(os.path.join(args.parsedir, filename))
+            and os.path.exists(os.path.join(args.ranksdir, filename))):
+        log.info("Unchanged, keeping {}".format(filename))
+        saved.append(len(record["pairs"]))
+        pairs = [tuple(pair) for pair in record["pairs"]]
+        changes["old"].extend(pairs)
+        changes["new"].extend(pairs)
+        return record["next"]
+
+    if args.backend == "lxml":
+        found, href = site.names(html, ranked_titles)
+    elif args.backend == "stream":
+        found, href = site.stream(page_source(count), ranked_titles)
     else:
+        found, href = soup_names(site, html)
+    pairs, ranked = split_ranks(found)
+    list_ = [name for name, title in pairs]
+    log.info("Junior faculty: \n {}".format(list_))
+
+    # save to file
+    save_roster(filename, list_)
+    save_ranks(filename, ranked)
+
+    # check if there's a next page
+    if href is None:
         log.info("Reached last page")
-        return None
+    else:
+        href = (args.url if site.next_base == "url" else "") + href
+        log.info("Next url for {} is {}".format(args.school, href))
+    remember(count, record, html, pairs, ranked, href)
+    return href
 
 
 # emory university
-def parse_emory(html):
+def emory_title(html):
     """
-    Need to open individual faculty's profile to see
-    position title.
+    Job title on an Emory faculty profile.
     -------------
-    html_file (str, name of the html file to parse)
+    html (bytes, html of the profile page)
     """
-    
-    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("body"))
-    
-    list_ = []
-    div = soup.find("div", {"class": "data-entry"})
-    for h3 in div.find_all("h3"):
-        href = h3.find("a")["href"]
-        base_url = "http://polisci.emory.edu/home/people/faculty/"
-        url = base_url + href
-        profile = BeautifulSoup(requests.get(url).content, "lxml",
-                                parse_only = SoupStrainer("body"))
-        title = profile.find("h4", {"itemprop" :"jobTitle"}).string
-        if title_pattern.search(title) != None:
-            list_.append(h3.find("a").string)
-    log.info("Junior faculty: \n {}".format(list_))
-        
-    # save to file
-    filename = args.school.replace(" ", "_") + ".json"
-    with open(os.path.join(args.parsedir, filename), "w") as j:
-        json.dump(list_, j)
+    profile = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("body"))
+    return profile.find("h4", {"itemprop" :"jobTitle"}).string
 
 
-# indiana university at bloomington
-def parse_indiana(html):
+# rochester
+def rochester_title(html):
     """
-    html_file (str, name of the html file to parse)
+    Job title on a Rochester faculty profile, None when the
+    title is not plain text.
+    -------------
+    html (bytes, html of the profile page)
     """
-    
-    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("main"))
-    
-    list_ = []
-    for string in soup.find_all(string = title_pattern):
-        name = string.find_previous(["h1", "a"]).string
-        list_.append(name)
+    profile = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("div", {"id": "content"}))
+    title = list(profile.find("p", {"class": "faculty-profile-information-title"}).children)[0]
+    if isinstance(title, NavigableString):
+        return str(title)
+    return None
+
+
+# title readers the specs refer to by name
+title_readers = {"emory": emory_title, "rochester": rochester_title}
+
+
+@measured
+def parse_profiles(html):
+    """
+    Need to open individual faculty's profile to see
+    position title. If a profile could not be read, or offline
+    is not in the profile cache, the saved roster is left as it is.
+    -------------
+    html (str, html content of the faculty page)
+    """
+    site = sites[args.school]
+    links = site.links(html)
+    titles = profiles.lookup([url for _, url in links],
+                             title_readers[site.profiles["title"]],
+                             session, profile_cache, args.workers,
+                             offline = args.offline)
+    missing = [url for _, url in links if url not in titles]
+    if missing:
+        log.error("Profile pages needed for {}, roster left as it was; missing:\n {}".format(
+            args.school, "\n ".join(missing)))
+        return
+    found = []
+    for a, url in links:
+        title = titles.get(url)
+        if title != None and ranked_titles.search(title) != None:
+            found.append((extract.string(a), title))
+    pairs, ranked = split_ranks(found)
+    list_ = [name for name, title in pairs]
     log.info("Junior faculty: \n {}".format(list_))
-    
+
     # save to file
     filename = args.school.replace(" ", "_") + ".json"
-    with open(os.path.join(args.parsedir, filename), "w") as j:
-        json.dump(list_, j)
+    save_roster(filename, list_)
+    save_ranks(filename, ranked)
+    remember(0, read_record(), html, pairs, ranked)
+
 
 
+"""
+STEP 2: Crawl faculty pages
+"""
 
+# compiled once; a school is found in constant time
+sites = extract.load_sites(args.specs)
 
 
-# ucla
-def parse_ucla(html):
+def follow_pages(parse, school, html, fetch, keep):
     """
-    html_file (str, name of the html file to parse)
+    Parse the first page of a paginated school and every page after
+    it. The pager is read off each page before it is parsed so the
+    next pages are already being fetched meanwhile; when the pager
+    shows the last page, all remaining pages are fetched at once.
+    The url returned by the parser decides which page comes next:
+    only that page is kept, and pages fetched ahead but never linked
+    to are dropped.
+    --------
+    parse (function, parse_page)
+    school (str, name of the school)
+    html (str, html content of the first page)
+    fetch (function, fetch_html or read_html)
+    keep (function, (school, fetched, count) -> html, e.g. save_html)
     """
-    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("body"))
-    
-    # get the names of associate/assistant professors
-    list_ = [] 
-    for string in soup.find_all("h2", string = title_pattern):
-        list_.append(string.find_previous("h1", string = True).string)
-    log.info("Junior faculty: \n {}".format(list_))
-    
-    # save to file 
-    filename = args.school.replace(" ", "_") + ".json"
-    with open(os.path.join(args.parsedir, filename), "w") as j:
-        json.dump(list_, j)
-        
-        
-# rochester
-def parse_rochester(html):
+    base = args.url if sites[school].next_base == "url" else ""
+    c = 0
+    pending = {}
+    with ThreadPoolExecutor(max_workers = args.workers) as pool:
+        while html is not None:
+            for i, href in enumerate(extract.pages_ahead(html)):
+                if base + href not in pending:
+                    pending[base + href] = pool.submit(fetch, school, base + href, c + 1 + i)
+            next_url = parse(html, c)
+            if next_url == None:
+                break
+            c += 1
+            if next_url in pending:
+                html = keep(school, pending.pop(next_url).result(), c)
+            else:
+                html = keep(school, fetch(school, next_url, c), c)
+        for future in pending.values():
+            future.cancel()
+
+
+def parse_html(school, url, html):
     """
-    html_file (str, name of the html file to parse)
+    Send the first faculty page of a school to its parser and
+    follow the next pages if the school has several. After a crawl,
+    the people added, removed or retitled since the pages were last
+    parsed are appended to `args.diffs`.
+    --------
+    school (str, name of the school)
+    url (str, url to the faculty page)
+    html (str, html content of the first page, None if it was not fetched)
     """
-    soup = BeautifulSoup(html, "lxml", parse_only = SoupStrainer("table", {"class": "people-table"}))
-    
-    list_ = []
-    for a in soup.find_all("a", {"href": re.compile("people")}):
-        href = a['href']
-        base_url = "https://www.sas.rochester.edu"
-        url = base_url + href
-        profile = BeautifulSoup(requests.get(url).content, "lxml", parse_only = SoupStrainer("div", {"id": "content"}))
-        title = list(profile.find("p", {"class": "faculty-profile-information-title"}).children)[0]
-        if (isinstance(title, NavigableString)) and (title_pattern.search(title) != None):
-            list_.append(a.string)
-    log.info("Junior faculty: \n {}".format(list_))
-     
-     
-    # save to file 
-    filename = args.school.replace(" ", "_") +  ".json"
-    with open(os.path.join(args.parsedir, filename), "w") as j:
-        json.dump(list_, j)
+    if html is None:
+        return
+    args.school = school
+    args.url = url
+    if args.offline:
+        fetch, keep = read_html, lambda school, html, count: html
+    else:
+        fetch, keep = fetch_html, save_html
+    site = sites.get(school)
+    changes.update(old = [], new = [], recorded = True)
+    if site is None or not site.parses():
+        log.info("Unable to parse html")
+    elif site.profiles:
+        parse_profiles(html)
+    elif site.pager:
+        follow_pages(parse_page, school, html, fetch, keep)
+    else:
+        parse_page(html)
 
+    # what the crawl changed, against the rosters recorded last time
+    if not args.offline and changes["recorded"]:
+        diff = roster_diff(changes["old"], changes["new"])
+        if any(diff.values()):
+            log.info("Roster of {} changed: {}".format(school, diff))
+            with open(args.diffs, "a") as j:
+                j.write(json.dumps(dict(date = time.strftime("%Y-%m-%d"),
+                                        school = school, **diff)) + "\n")
+
+
+def crawl(dict_):
+    """
+    Fetch the first page of every school in parallel and parse
+    each page as soon as it arrives. Parsing stays in the calling
+    thread because the parsers share `args`.
+    --------
+    dict_ (dict, school name to url of its faculty page)
+    """
+    with ThreadPoolExecutor(max_workers = args.workers) as pool:
+        futures = {pool.submit(get_html, school, url): (school, url)
+                   for school, url in dict_.items()}
+        for future in as_completed(futures):
+            school, url = futures[future]
+            try:
+                html = future.result()
+            except requests.exceptions.RequestException as e:
+                log.error("Unable to fetch {}: {}".format(school, e))
+                continue
+            parse_html(school, url, html)
+
+
+def reparse(school, url):
+    """
+    Parse the saved pages of one school. Runs in a worker process.
+    Profile titles for Emory and Rochester come from the profile cache.
+    --------
+    school (str, name of the school)
+    url (str, url to the faculty page)
+    """
+    html = read_html(school, url)
+    if html is not None:
+        parse_html(school, url, html)
+
+
+def reparse_all(dict_):
+    """
+    Re-derive every roster from the pages saved in `args.pagedir`,
+    one school per process since parsing is CPU-bound.
+    --------
+    dict_ (dict, school name to url of its faculty page)
+    """
+    with ProcessPoolExecutor(max_workers = args.workers) as pool:
+        futures = {pool.submit(reparse, school, url): school
+                   for school, url in dict_.items()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                log.error("Unable to parse {}: {}".format(futures[future], e))
 
 
 if __name__ == "__main__":
     
-    gp0 = ['HARVARD UNIVERSITY', 'PRINCETON UNIVERSITY']
-    gp1 = ['UNIVERSITY OF WISCONSIN-MADISON',
-           'STANFORD UNIVERSITY', 'MASSACHUSETTS INSTITUTE OF TECHNOLOGY',
-           'COLUMBIA UNIVERSITY IN THE CITY OF NEW YORK',
-           'PENN STATE UNIVERSITY', 'UNIVERSITY OF WASHINGTON']
-    gp2 = ['TEXAS A & M UNIVERSITY',
-           'UNIVERSITY OF NORTH CAROLINA AT CHAPEL HILL']
-    gp3 = ['DUKE UNIVERSITY', 'NEW YORK UNIVERSITY', 
-           'UNIVERSITY OF CALIFORNIA-SAN DIEGO', 
-           'UNIVERSITY OF CHICAGO', 
-           'UNIVERSITY OF ILLINOIS AT URBANA-CHAMPAIGN',
-           'VANDERBILT UNIVERSITY', 'WASHINGTON UNIVERSITY IN ST. LOUIS']
-    gp4 = ['UNIVERSITY OF CALIFORNIA-BERKELEY',
-           'YALE UNIVERSITY']
-    
-    gp_ = ['UNIVERSITY OF CALIFORNIA-DAVIS', 
-           'UNIVERSITY OF MICHIGAN-ANN ARBOR']
-    
     with open("data/faculty_page_links.json") as j:
         dict_ = json.load(j)
     
-    for school, url in dict_.items():
-        args.school = school
-        c = 0
-        html = get_html(args.school, url, c)
-        if args.school in gp0:
-            next_url = parse_school0(html, c)
-            while next_url != None:
-                c += 1
-                html = get_html(args.school, next_url, c)
-                next_url = parse_school0(html, c)
-        if args.school in gp1:
-            parse_school1(html)
-        if args.school in gp2:
-            parse_school2(html)
-        if args.school in gp3:
-            parse_school3(html)
-        if args.school in gp4:
-            next_url = parse_school4(html, c)
-            while next_url != None:
-                c += 1
-                html = get_html(school, next_url, c)
-                next_url = parse_school4(html, c)
-        if args.school in gp_:
-            log.info("Unable to parse html")
-        if "EMORY" in args.school:
-            parse_emory(html)
-        if "LOS ANGELES" in args.school:
-            parse_ucla(html)
-        if "ROCHESTER" in args.school:
-            parse_rochester(html)
-    
-    sys.exit()
-    
-
-    
-    
-    
-    
-    
-    
-    
+    with metrics.stage(stage):
+        try:
+            if args.offline and metrics.profiled.get(stage):
+                # the profiler only sees this process
+                for school, url in dict_.items():
+                    reparse(school, url)
+            elif args.offline:
+                reparse_all(dict_)
+            elif args.concurrent:
+                crawl(dict_)
+            else:
+                for school, url in dict_.items():
+                    html = get_html(school, url)
+                    parse_html(school, url, html)
+        finally:
+            # the cache index is written once for the whole crawl
+            if cache is not None:
+                cache.save()
+
+    # one transaction for the whole crawl, once every page is parsed
+    roster_store.RosterStore(args.rosters).write(roster_store.read_dir(args.parsedir),
+                                                 source = "reparse" if args.offline else "crawl",
+                                                 ranks = roster_store.read_dir(args.ranksdir)
+                                                 if os.path.isdir(args.ranksdir) else None)
+    
+    sys.exit()
\ No newline at end of file
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent HTTP cache for faculty pages and CVs. Every request is
+sent with If-None-Match/If-Modified-Since taken from the last
+response, or from the header sidecars saved next to the .html/.pdf
+files by get_html() and download_cv(), and a 304 is answered with
+the stored body. Entries not used for `max_age` seconds are evicted,
+then the least recently used ones until the store fits in `max_size`
+bytes. The index is written by save(), once a batch of requests is
+done, rather than on every response.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+def read_sidecar(sidecar):
+    """
+    Read the response headers saved next to a page or CV.
+    get_html() saves "last modified" while download_cv() saves the
+    full response headers, so keys are looked up without case.
+    --------
+    sidecar (str, path to the json file with the response headers)
+    """
+    try:
+        with open(sidecar) as j:
+            return CaseInsensitiveDict(json.load(j))
+    except (OSError, ValueError, TypeError):
+        return CaseInsensitiveDict()
+
+
+def validators(headers):
+    """
+    Build the conditional request headers from response headers.
+    --------
+    headers (CaseInsensitiveDict, headers of the stored response)
+    """
+    conditional = {}
+    if headers.get("etag"):
+        conditional["If-None-Match"] = headers["etag"]
+    last_modified = headers.get("last-modified") or headers.get("last modified")
+    if last_modified:
+        conditional["If-Modified-Since"] = last_modified
+    return conditional
+
+
+class HTTPCache:
+    """
+    Bodies are stored under `cachedir` by the sha1 of their url and
+    described in `cachedir/index.json`. A url that is not in the index
+    falls back to the copy saved by an earlier run (`path`/`sidecar`),
+    so evicted entries are still revalidated against the archive.
+    --------
+    cachedir (str, directory storing the cached bodies)
+    max_age (int, seconds an entry is kept without being used)
+    max_size (int, bytes the stored bodies may take)
+    """
+
+    def __init__(self, cachedir = "data/http_cache",
+                 max_age = 30 * 24 * 3600, max_size = 200 * 1024 * 1024):
+        self.cachedir = cachedir
+        self.max_age = max_age
+        self.max_size = max_size
+        self.indexfile = os.path.join(cachedir, "index.json")
+        self.lock = threading.Lock()
+        self.changed = False
+        os.makedirs(cachedir, exist_ok = True)
+        try:
+            with open(self.indexfile) as j:
+                self.index = json.load(j)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def bodyfile(self, url):
+        return os.path.join(self.cachedir,
+                            hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    def get(self, session, url, path = None, sidecar = None, **kwargs):
+        """
+        GET `url` through `session`, revalidating the stored copy.
+        The returned response has `from_cache` set to True when the
+        body was served from disk after a 304.
+        --------
+        session (requests.Session or the requests module)
+        url (str, url to fetch)
+        path (str, copy of the body saved by an earlier run)
+        sidecar (str, json file with the headers of that copy)
+        """
+        headers = dict(kwargs.pop("headers", None) or {})
+        with self.lock:
+            entry = self.index.get(url)
+        if entry is not None and os.path.exists(self.bodyfile(url)):
+            stored = self.bodyfile(url)
+            stored_headers = CaseInsensitiveDict(entry["headers"])
+        elif path is not None and sidecar is not None and os.path.exists(path):
+            stored = path
+            stored_headers = read_sidecar(sidecar)
+        else:
+            stored = None
+        if stored is not None:
+            headers.update(validators(stored_headers))
+
+        r = session.get(url, headers = headers, **kwargs)
+        r.from_cache = False
+        if r.status_code == 304 and stored is not None:
+            with open(stored, "rb") as f:
+                r._content = f.read()
+            r._content_consumed = True
+            stored_headers.update(r.headers)
+            r.headers = stored_headers
+            r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+            r.status_code = 200
+            r.from_cache = True
+        if r.status_code == 200:
+            self.store(url, r)
+        return r
+
+    def store(self, url, r):
+        """
+        Save the body and headers of a successful response.
+        --------
+        url (str, url the response belongs to)
+        r (requests.Response, response with its body read)
+        """
+        bodyfile = self.bodyfile(url)
+        if not (r.from_cache and os.path.exists(bodyfile)):
+            with open(bodyfile + ".tmp", "wb") as f:
+                f.write(r.content)
+            os.replace(bodyfile + ".tmp", bodyfile)
+        with self.lock:
+            self.index[url] = {"headers": dict(r.headers),
+                               "size": len(r.content),
+                               "used": time.time()}
+            self.changed = True
+
+    def drop(self, url):
+        """
+        Remove an entry and its body. Must be called with the lock held.
+        --------
+        url (str, url of the entry)
+        """
+        del self.index[url]
+        try:
+            os.remove(self.bodyfile(url))
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Drop entries unused for `max_age`, then the least recently
+        used ones until the stored bodies fit in `max_size`.
+        Must be called with the lock held.
+        """
+        now = time.time()
+        for url in [url for url, entry in self.index.items()
+                    if now - entry["used"] > self.max_age]:
+            self.drop(url)
+        total = sum(entry["size"] for entry in self.index.values())
+        for url in sorted(self.index, key = lambda u: self.index[u]["used"]):
+            if total <= self.max_size:
+                break
+            total -= self.index[url]["size"]
+            self.drop(url)
+
+    def save(self):
+        """
+        Evict and write the index if a response was stored since it
+        was last written.
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            self.evict()
+            with open(self.indexfile + ".tmp", "w") as j:
+                json.dump(self.index, j)
+            os.replace(self.indexfile + ".tmp", self.indexfile)
+            self.changed = False
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Timings of every fetch and every parse, appended as json lines to a
+metrics file, and a report of the slowest hosts and parsers.
+Fetches are timed by the scheduler's adapter (dns lookup, connection,
+time to the headers and transfer of the body) and parses by
+get_junior_faculty.py. A stage can also run under cProfile or
+tracemalloc. Recording is off unless a metrics file is set, through
+configure() or the METRICS_FILE environment variable; METRICS_PROFILE
+("rosters:cprofile,pages:tracemalloc") picks the profiled stages.
+Run as a script to print the report.
+"""
+import sys
+import argparse
+import os
+import io
+import json
+import time
+import socket
+import pstats
+import cProfile
+import tracemalloc
+import threading
+import statistics
+from contextlib import contextmanager
+from collections import defaultdict
+
+
+path = os.environ.get("METRICS_FILE") or None
+profiled = dict(item.split(":", 1) for item in
+                os.environ.get("METRICS_PROFILE", "").split(",") if ":" in item)
+# the pipeline passes one run id to all its stages
+run = os.environ.get("METRICS_RUN") or "{}-{}".format(time.strftime("%Y%m%dT%H%M%S"),
+                                                      os.getpid())
+
+lock = threading.Lock()
+local = threading.local()
+
+
+def configure(file = None, profile = None):
+    """
+    Start recording to `file` and profile stages as in `profile`.
+    --------
+    file (str, jsonl metrics file)
+    profile (dict, stage name -> "cprofile" or "tracemalloc")
+    """
+    global path
+    if file:
+        path = file
+    if profile:
+        profiled.update(profile)
+    if path:
+        install_connect_timer()
+
+
+def enabled():
+    return path is not None
+
+
+def record(kind, **fields):
+    """
+    Append one record. The file is opened for every record so that
+    worker processes can write to it as well.
+    --------
+    kind (str, "fetch", "parse", "download", "profile", ...)
+    fields (values to record)
+    """
+    if path is None:
+        return
+    fields = dict(kind = kind, run = run, time = round(time.time(), 3), **fields)
+    line = json.dumps(fields) + "\n"
+    with lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(path, "a") as f:
+            f.write(line)
+
+
+def install_connect_timer():
+    """
+    Time the connections urllib3 opens (dns, tcp and tls), and the
+    name lookups made while opening them, kept per thread until taken
+    by connect_time() and dns_time().
+    """
+    import urllib3.connection
+    for cls in (urllib3.connection.HTTPConnection, urllib3.connection.HTTPSConnection):
+        if getattr(cls.connect, "timed", False):
+            continue
+
+        def timed(self, _connect = cls.connect):
+            start = time.perf_counter()
+            local.connecting = True
+            try:
+                return _connect(self)
+            finally:
+                local.connecting = False
+                local.connect = ((getattr(local, "connect", None) or 0)
+                                 + time.perf_counter() - start)
+        timed.timed = True
+        cls.connect = timed
+
+    # urllib3 looks the host up through socket.getaddrinfo when it connects
+    if not getattr(socket.getaddrinfo, "timed", False):
+        def getaddrinfo(*args, _getaddrinfo = socket.getaddrinfo, **kwargs):
+            if not getattr(local, "connecting", False):
+                return _getaddrinfo(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return _getaddrinfo(*args, **kwargs)
+            finally:
+                local.dns = ((getattr(local, "dns", None) or 0)
+                             + time.perf_counter() - start)
+        getaddrinfo.timed = True
+        socket.getaddrinfo = getaddrinfo
+
+
+def connect_time():
+    """
+    Seconds spent opening connections in this thread since the last
+    call, None if the request reused a connection.
+    """
+    seconds = getattr(local, "connect", None)
+    local.connect = None
+    return round(seconds, 4) if seconds is not None else None
+
+
+def dns_time():
+    """
+    Seconds spent resolving host names while opening connections in
+    this thread since the last call, part of connect_time(); None if
+    the request reused a connection.
+    """
+    seconds = getattr(local, "dns", None)
+    local.dns = None
+    return round(seconds, 4) if seconds is not None else None
+
+
+if path:
+    install_connect_timer()
+
+
+@contextmanager
+def stage(name):
+    """
+    Run a stage under the profiler chosen for it, if any, and record
+    the hottest functions (cProfile) or the peak memory and largest
+    allocation sites (tracemalloc).
+    --------
+    name (str, stage name)
+    """
+    mode = profiled.get(name)
+    start = time.perf_counter()
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif mode == "tracemalloc":
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        seconds = round(time.perf_counter() - start, 3)
+        if mode == "cprofile":
+            profiler.disable()
+            out = io.StringIO()
+            stats = pstats.Stats(profiler, stream = out)
+            if path:
+                stats.dump_stats(os.path.join(os.path.dirname(path) or ".",
+                                              "{}-{}.prof".format(name, run)))
+            top = sorted(stats.stats.items(), key = lambda item: -item[1][3])[:20]
+            record("profile", stage = name, mode = mode, seconds = seconds,
+                   top = [{"function": "{}:{}({})".format(*func),
+                           "calls": calls, "tottime": round(tt, 4), "cumtime": round(ct, 4)}
+                          for func, (_, calls, tt, ct, _) in top])
+        elif mode == "tracemalloc":
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            record("profile", stage = name, mode = mode, seconds = seconds,
+                   peak_kb = peak // 1024,
+                   top = [{"site": str(stat.traceback), "kb": stat.size // 1024,
+                           "count": stat.count}
+                          for stat in snapshot.statistics("lineno")[:20]])
+        else:
+            record("stage", stage = name, seconds = seconds)
+
+
+def read(file):
+    with open(file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(records, top = 10, slowdown = 2.0):
+    """
+    Print the slowest hosts and parsers of the latest run, and the
+    hosts whose median fetch time grew `slowdown` times compared with
+    the runs before it.
+    --------
+    records (list, metrics records)
+    top (int, rows per table)
+    slowdown (float, ratio of medians reported as a slowdown)
+    """
+    latest = {}
+    for r in records:
+        if r["kind"] in ("fetch", "parse"):
+            latest[r["kind"]] = max(latest.get(r["kind"], ""), r["run"])
+    if not latest:
+        print("No fetch or parse records")
+        return
+
+    hosts = defaultdict(list)
+    before = defaultdict(list)
+    for r in records:
+        if r["kind"] == "fetch":
+            (hosts if r["run"] == latest["fetch"] else before)[r["host"]].append(r)
+    print("Slowest hosts in run {}".format(latest.get("fetch")))
+    print("{:40} {:>5} {:>8} {:>8} {:>8} {:>10}".format(
+        "host", "n", "median", "p95", "max", "kb"))
+    rows = sorted(hosts.items(), key = lambda item: -statistics.median(
+        r["seconds"] for r in item[1]))
+    for host, rs in rows[:top]:
+        seconds = [r["seconds"] for r in rs]
+        print("{:40} {:>5} {:>8.3f} {:>8.3f} {:>8.3f} {:>10.1f}".format(
+            host[:40], len(rs), statistics.median(seconds), percentile(seconds, 0.95),
+            max(seconds), sum(r.get("bytes") or 0 for r in rs) / 1024))
+
+    parses = defaultdict(list)
+    for r in records:
+        if r["kind"] == "parse" and r["run"] == latest["parse"]:
+            parses[(r["parser"], r.get("school"))].append(r)
+    print("\nSlowest parsers in run {}".format(latest.get("parse")))
+    print("{:16} {:45} {:>5} {:>8} {:>6} {:>10}".format(
+        "parser", "school", "pages", "seconds", "names", "kb"))
+    rows = sorted(parses.items(), key = lambda item: -sum(r["seconds"] for r in item[1]))
+    for (parser, school), rs in rows[:top]:
+        print("{:16} {:45} {:>5} {:>8.3f} {:>6} {:>10.1f}".format(
+            parser, (school or "")[:45], len(rs), sum(r["seconds"] for r in rs),
+            sum(r.get("names") or 0 for r in rs), sum(r.get("bytes") or 0 for r in rs) / 1024))
+
+    slower = []
+    for host, rs in hosts.items():
+        if before.get(host):
+            now = statistics.median(r["seconds"] for r in rs)
+            then = statistics.median(r["seconds"] for r in before[host])
+            if then > 0 and now / then >= slowdown:
+                slower.append((now / then, host, then, now))
+    if slower:
+        print("\nHosts slower than in earlier runs")
+        for ratio, host, then, now in sorted(slower, reverse = True):
+            print("{:40} {:>8.3f} -> {:>8.3f} ({:.1f}x)".format(host[:40], then, now, ratio))
+
+
+if __name__ == "__main__":
+
+    # set argument parser
+    parser = argparse.ArgumentParser(description='Report the slowest hosts and parsers.')
+    parser.add_argument("-file", type = str,
+                        help = "Metrics file.",
+                        default = "data/metrics/metrics.jsonl")
+    parser.add_argument("-top", type = int,
+                        help = "Rows per table.",
+                        default = 10)
+    parser.add_argument("-slowdown", type = float,
+                        help = "Ratio of median fetch times reported as a slowdown.",
+                        default = 2.0)
+    args = parser.parse_args()
+
+    report(read(args.file), args.top, args.slowdown)
+
+    sys.exit()
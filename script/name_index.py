@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Index of people's names for joining the rosters to the CVs and to the
+search results when the spellings differ: accents, middle names or
+initials, stray spaces, honorifics and post-nominals ("Dr.", "Jr.",
+"PhD"), or CV keys written without spaces ("GermánGieczewski").
+Names are normalized as in roster_store.py and
+filed under blocking keys, the Soundex code and the trigrams of the
+last name, so a lookup only scores the few entries sharing a block
+with it instead of the whole index. Scores run from 0 to 1, 1 being
+the same normalized name.
+Run as a script to match the roster store against the CV store.
+"""
+import sys
+import argparse
+import logging
+from difflib import SequenceMatcher
+from collections import defaultdict, Counter
+import roster_store
+import cv_store
+
+
+log = logging.getLogger(__name__)
+
+suffixes = {"jr", "sr", "ii", "iii", "iv", "phd", "dphil", "md", "jd", "esq"}
+
+# titles written before a name, left out while it keeps a first and last name
+honorifics = {"dr", "prof", "professor", "mr", "mrs", "ms", "miss", "mx"}
+
+# dotted post-nominals, as the words normalize() leaves of them, e.g. "Ph.D."
+postnominals = [("ph", "d"), ("d", "phil"), ("m", "d"), ("j", "d")]
+
+soundex_codes = dict(zip("bfpvcgjkqsxzdtlmnr", "111122222222334556"))
+
+
+def split_key(key):
+    """
+    Words of a name written without spaces, split before each capital
+    letter that follows a letter, except after "Mc".
+    --------
+    key (str, e.g. "AlisonEJMcQueen")
+    """
+    words = []
+    for i, c in enumerate(key):
+        if (i and c.isupper() and key[i - 1].isalpha() and key[max(0, i - 2):i] != "Mc"):
+            words.append(" ")
+        words.append(c)
+    return "".join(words)
+
+
+def soundex(word):
+    """
+    Soundex code of `word`, e.g. "r163" for Rupert and Robert.
+    --------
+    word (str, normalized word)
+    """
+    letters = [c for c in word if "a" <= c <= "z"]
+    if not letters:
+        return ""
+    code = letters[0]
+    last = soundex_codes.get(letters[0])
+    for c in letters[1:]:
+        digit = soundex_codes.get(c)
+        if digit and digit != last:
+            code += digit
+        if c not in "hw":
+            last = digit
+    return (code + "000")[:4]
+
+
+def trigrams(word):
+    word = "^{}$".format(word)
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class Name:
+    """
+    A name split into first, middle and last names.
+    --------
+    name (str, name as written on a roster, a CV key or a search result)
+    """
+
+    def __init__(self, name):
+        self.raw = name
+        if not any(c.isspace() or c == "." for c in name.strip()):
+            name = split_key(name.strip())
+        words = roster_store.normalize(name).split()
+        while len(words) > 2 and words[0] in honorifics:
+            words = words[1:]
+        stripped = True
+        while stripped:
+            stripped = False
+            for post in postnominals:
+                if len(words) > len(post) + 1 and tuple(words[-len(post):]) == post:
+                    words = words[:-len(post)]
+                    stripped = True
+        words = [w for w in words if w not in suffixes]
+        self.first = words[0] if words else ""
+        self.last = words[-1] if len(words) > 1 else ""
+        self.middle = words[1:-1]
+        self.key = " ".join(words)
+
+    def blocks(self):
+        last = self.last.replace("-", "")
+        return {"s:" + soundex(last)} | {"t:" + t for t in trigrams(last)}
+
+
+def ratio(a, b):
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def similarity(a, b):
+    """
+    Confidence from 0 to 1 that two names are the same person. The
+    likeness of the last names, squared so that "Hall" and "Hull" are
+    told apart, scales that of the first names, of which an initial is
+    enough, and of the middle names, which may be left out.
+    --------
+    a (Name)
+    b (Name)
+    """
+    if a.key == b.key:
+        return 1.0
+    if a.last == b.last:
+        last = 1.0
+    elif a.last and b.last and (a.last in b.last.split("-") or b.last in a.last.split("-")):
+        last = 0.9
+    else:
+        last = ratio(a.last, b.last)
+    if a.first == b.first:
+        first = 1.0
+    elif a.first and b.first and (len(a.first) == 1 or len(b.first) == 1) \
+            and a.first[0] == b.first[0]:
+        first = 0.8
+    else:
+        first = ratio(a.first, b.first)
+    if not a.middle or not b.middle:
+        middle = 0.9
+    elif [m[0] for m in a.middle] == [m[0] for m in b.middle]:
+        middle = 1.0
+    else:
+        middle = 0.5
+    return round(last ** 2 * (0.6 + 0.3 * first + 0.1 * middle), 3)
+
+
+class NameIndex:
+    """
+    --------
+    items (iterable, (name, value) pairs to index)
+    """
+
+    def __init__(self, items = ()):
+        self.names = []
+        self.values = []
+        self.exact = defaultdict(list)
+        self.blocks = defaultdict(list)
+        for name, value in items:
+            self.add(name, value)
+
+    def add(self, name, value = None):
+        """
+        Index `name`, returned with `value` when matched.
+        --------
+        name (str, name to index)
+        value (anything, e.g. a CV key; default: the name)
+        """
+        i = len(self.names)
+        parsed = Name(name)
+        self.names.append(parsed)
+        self.values.append(name if value is None else value)
+        self.exact[parsed.key].append(i)
+        for block in parsed.blocks():
+            self.blocks[block].append(i)
+
+    def candidates(self, name):
+        """
+        Entries sharing the Soundex block of `name`'s last name or at
+        least half of its trigrams.
+        --------
+        name (Name)
+        """
+        blocks = name.blocks()
+        found = set(self.blocks.get(next(b for b in blocks if b.startswith("s:")), ()))
+        shared = Counter(i for b in blocks if b.startswith("t:")
+                         for i in self.blocks.get(b, ()))
+        needed = max(1, (len(blocks) - 1) // 2)
+        found.update(i for i, n in shared.items() if n >= needed)
+        return found
+
+    def match(self, name, limit = 3, threshold = 0.8):
+        """
+        [(value, indexed name, score)] of the best matches of `name`,
+        best first, scoring at least `threshold`.
+        --------
+        name (str, name to look up)
+        limit (int, number of matches returned)
+        threshold (float, lowest score returned)
+        """
+        parsed = Name(name)
+        exact = self.exact.get(parsed.key)
+        if exact:
+            return [(self.values[i], self.names[i].raw, 1.0) for i in exact[:limit]]
+        scored = sorted(((similarity(parsed, self.names[i]), i)
+                         for i in self.candidates(parsed)), reverse = True)
+        return [(self.values[i], self.names[i].raw, score)
+                for score, i in scored[:limit] if score >= threshold]
+
+    def best(self, name, threshold = 0.8):
+        """
+        (value, score) of the best match of `name`, (None, 0) if none
+        scores `threshold`.
+        --------
+        name (str, name to look up)
+        threshold (float, lowest score accepted)
+        """
+        found = self.match(name, 1, threshold)
+        return (found[0][0], found[0][2]) if found else (None, 0)
+
+
+if __name__ == "__main__":
+
+    # set argument parser
+    parser = argparse.ArgumentParser(description='Match the rosters to the CVs.')
+    parser.add_argument("-rosters", type = str,
+                        help = "SQLite file of the roster store.",
+                        default = "data/rosters.sqlite")
+    parser.add_argument("-storedir", type = str,
+                        help = "Directory of the content-addressed CV store.",
+                        default = "data/cv_store")
+    parser.add_argument("-threshold", type = float,
+                        help = "Lowest score of a match.",
+                        default = 0.8)
+    parser.add_argument("-v", "--verbose",
+                        help = "Set logging level to DEBUG.",
+                        action = "store_true")
+    args = parser.parse_args()
+
+    # set logging
+    log.setLevel(logging.ERROR)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    loghandler = logging.StreamHandler(sys.stderr)
+    loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    log.addHandler(loghandler)
+
+    index = NameIndex((key, key) for key in cv_store.CVStore(args.storedir).index)
+    for school, _, name in roster_store.RosterStore(args.rosters).roster():
+        key, score = index.best(name, args.threshold)
+        print("{:.3f}\t{}\t{}\t{}".format(score, school, name, key or ""))
+
+    sys.exit()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run the replication as a chain of stages,
+links -> pages -> rosters -> cv_urls -> cvs -> text -> counts,
+re-executing only the stages whose inputs changed. A stage's
+fingerprint is the hash of its code, i.e. the syntax tree of the
+functions and assignments it depends on, so comments and formatting do
+not count, together with its command and the hashes of the outputs of
+the stages it reads. Editing ranks.py, for example, changes the
+rosters fingerprint and everything downstream of it, but not the
+crawl. The links are kept by hand; the runner only reports when
+their inputs changed. The CV urls come from cv_search.py, which keeps
+urls already in the manifest, so urls corrected by hand stay.
+"""
+import sys
+import argparse
+import logging
+import os
+import ast
+import json
+import fnmatch
+import time
+import hashlib
+import subprocess
+
+
+# set argument parser
+parser = argparse.ArgumentParser(description='Run the stages whose inputs changed.')
+parser.add_argument("-state", type = str,
+                    help = "Json file storing the fingerprint of each stage.",
+                    default = "data/pipeline_state.json")
+parser.add_argument("-force", type = str, nargs = "*", default = [],
+                    help = "Stages to rerun, with everything downstream, even if unchanged.")
+parser.add_argument("-until", type = str,
+                    help = "Last stage to run.")
+parser.add_argument("-metrics", type = str,
+                    help = "Jsonl file the stages record their fetch and parse timings to.")
+parser.add_argument("-profile", type = str, nargs = "*", default = [],
+                    help = "Stages to profile, as stage:cprofile or stage:tracemalloc.")
+parser.add_argument("--dry-run",
+                    help = "List the stages that would run without running them.",
+                    action = "store_true")
+parser.add_argument("-v", "--verbose",
+                    help = "Set logging level to DEBUG.",
+                    action = "store_true")
+args = parser.parse_args(None if __name__ == "__main__" else [])
+
+
+# set logging
+log = logging.getLogger(__name__)
+log.setLevel(logging.ERROR)
+if args.verbose:
+    log.setLevel(logging.DEBUG)
+loghandler = logging.StreamHandler(sys.stderr)
+loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+log.addHandler(loghandler)
+
+
+script = os.path.dirname(os.path.abspath(__file__))
+gjf = os.path.join(script, "get_junior_faculty.py")
+specs = "data/site_specs.json"
+
+# in order; "code" maps a file to the names it depends on (None: all of it,
+# or the content of a json file)
+# and "outputs" lists (path, file patterns left out of the hash)
+stages = [
+    {"name": "links",
+     "inputs": [],
+     "code": {os.path.join(script, "top25.py"): ["NRC_2010", "USNEWS_2017", "top25"]},
+     "command": None,
+     "outputs": [("data/faculty_page_links.json", [])]},
+    {"name": "pages",
+     "inputs": ["links"],
+     "code": {gjf: ["page_path", "page_hash", "saved_hash", "get_html", "fetch_html",
+                    "save_html", "follow_pages", "crawl"],
+              specs: None,
+              os.path.join(script, "http_cache.py"): None,
+              os.path.join(script, "scheduler.py"): None},
+     "command": [gjf, "--concurrent"],
+     "outputs": [("data/faculty_page", ["*.json"])]},
+    {"name": "rosters",
+     "inputs": ["links", "pages"],
+     "code": {gjf: ["ranked_titles", "read_html", "soup_pagers", "soup_names",
+                    "page_path", "page_source", "page_hash", "changes", "parser_version",
+                    "read_record",
+                    "remember", "roster_diff", "parse_page", "emory_title",
+                    "rochester_title", "title_readers",
+                    "parse_profiles", "sites", "save_roster", "save_ranks", "split_ranks",
+                    "measured",
+                    "follow_pages", "parse_html", "reparse", "reparse_all"],
+              specs: None,
+              os.path.join(script, "extract.py"): None,
+              os.path.join(script, "profiles.py"): None,
+              os.path.join(script, "roster_store.py"): None,
+              os.path.join(script, "ranks.py"): None},
+     "command": [gjf, "--offline"],
+     "outputs": [("data/faculty_names", []), ("data/faculty_ranks", []),
+                 ("data/rosters.sqlite", [])]},
+    {"name": "cv_urls",
+     "inputs": ["rosters"],
+     "code": {os.path.join(script, "cv_search.py"): None,
+              os.path.join(script, "profiles.py"): ["ProfileCache"],
+              os.path.join(script, "scheduler.py"): None},
+     "command": [os.path.join(script, "cv_search.py")],
+     "outputs": [("data/cv_manifest.csv", [])]},
+    {"name": "cvs",
+     "inputs": ["cv_urls"],
+     "code": {os.path.join(script, "download.py"): None,
+              os.path.join(script, "scheduler.py"): None,
+              os.path.join(script, "download_cv.py"): ["read_manifest", "download_batch"]},
+     "command": [os.path.join(script, "download_cv.py"), "-manifest", "data/cv_manifest.csv"],
+     "outputs": [("data/faculty_cv", ["*.json", "*.part", "*.log"])]},
+    {"name": "text",
+     "inputs": ["cvs"],
+     "code": {os.path.join(script, "extract_text.py"): ["text_path", "extract", "extract_all"],
+              os.path.join(script, "cv_store.py"): ["CVStore"]},
+     "command": [os.path.join(script, "extract_text.py")],
+     "outputs": [("data/cv_store/text", [])]},
+    {"name": "counts",
+     "inputs": ["rosters", "text"],
+     "code": {os.path.join(script, "publication_index.py"): None,
+              os.path.join(script, "analysis.py"): None},
+     "command": [os.path.join(script, "publication_index.py")],
+     "then": [os.path.join(script, "analysis.py")],
+     "outputs": [("data/publications.sqlite", []), ("data/tables", [])]},
+]
+
+
+def code_version(file, names = None):
+    """
+    Hash of the syntax tree of the top-level definitions and
+    assignments called `names` in `file`, or of the whole file. The
+    hash of a json file is that of its content, whatever its layout.
+    --------
+    file (str, python or json file)
+    names (list, functions, classes or variables the stage uses)
+    Raises ValueError if `file` does not define one of `names`.
+    """
+    if file.endswith(".json"):
+        with open(file) as j:
+            return hashlib.sha256(json.dumps(json.load(j), sort_keys = True)
+                                  .encode()).hexdigest()
+    with open(file) as f:
+        tree = ast.parse(f.read(), filename = file)
+    if names is None:
+        return hashlib.sha256(ast.dump(tree).encode()).hexdigest()
+    found = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            found[node.name] = node
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    found[target.id] = node
+    missing = [name for name in names if name not in found]
+    if missing:
+        raise ValueError("{} no longer defines {}, update the stages in pipeline.py".format(
+            os.path.basename(file), ", ".join(missing)))
+    digest = hashlib.sha256()
+    for name in names:
+        digest.update(ast.dump(found[name]).encode())
+    return digest.hexdigest()
+
+
+def output_hash(outputs):
+    """
+    Hash of the content of the output files and directories, None if
+    one of them does not exist.
+    --------
+    outputs (list, (path, patterns of files left out))
+    """
+    digest = hashlib.sha256()
+    for path, exclude in outputs:
+        if os.path.isfile(path):
+            files = [path]
+        elif os.path.isdir(path):
+            files = sorted(os.path.join(root, file)
+                           for root, _, names in os.walk(path) for file in names
+                           if not any(fnmatch.fnmatch(file, p) for p in exclude))
+        else:
+            return None
+        for file in files:
+            digest.update(os.path.relpath(file, path).encode())
+            with open(file, "rb") as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(stage, hashes):
+    """
+    Hash of the code, command and input hashes of a stage.
+    --------
+    stage (dict, entry of `stages`)
+    hashes (dict, stage name -> output hash)
+    """
+    code = {os.path.basename(file): code_version(file, names)
+            for file, names in stage["code"].items()}
+    inputs = {name: hashes[name] for name in stage["inputs"]}
+    command = [os.path.basename(a) for a in (stage["command"] or []) + stage.get("then", [])]
+    return hashlib.sha256(json.dumps([code, command, inputs], sort_keys = True)
+                          .encode()).hexdigest()
+
+
+def read_state(path):
+    try:
+        with open(path) as j:
+            return json.load(j)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok = True)
+    with open(path + ".tmp", "w") as j:
+        json.dump(state, j, indent = 1)
+    os.replace(path + ".tmp", path)
+
+
+def environment():
+    """
+    Environment of the stages, turning on metrics and profiling.
+    """
+    env = dict(os.environ)
+    if args.metrics:
+        env["METRICS_FILE"] = args.metrics
+        env["METRICS_RUN"] = "{}-{}".format(time.strftime("%Y%m%dT%H%M%S"), os.getpid())
+    if args.profile:
+        env["METRICS_PROFILE"] = ",".join(args.profile)
+    return env
+
+
+def run(stages, state, force = (), until = None, dry_run = False):
+    """
+    Run, in order, every stage that is forced, downstream of a forced
+    stage, has no output, or whose fingerprint changed. Returns the
+    names of the stages run, and stops at the first one that fails.
+    --------
+    stages (list, stage declarations)
+    state (dict, stage name -> {"fingerprint", "outputs"} of the last run)
+    force (list, names of stages to rerun)
+    until (str, name of the last stage to consider)
+    dry_run (bool, only report)
+    """
+    hashes = {}
+    env = environment()
+    forced = set(force)
+    ran = []
+    for stage in stages:
+        name = stage["name"]
+        key = fingerprint(stage, hashes)
+        outputs = output_hash(stage["outputs"])
+        if forced & set(stage["inputs"]):
+            forced.add(name)
+        stale = name in forced or outputs is None or state.get(name, {}).get("fingerprint") != key
+
+        if stale and stage["command"] is None:
+            if outputs is None:
+                log.error("{}: {} is kept by hand and missing".format(
+                    name, stage["outputs"][0][0]))
+                return ran
+            log.error("{}: inputs changed, check {} by hand".format(
+                name, stage["outputs"][0][0]))
+        elif stale:
+            log.info("{}: running".format(name))
+            ran.append(name)
+            if dry_run:
+                outputs = "dry run"
+            else:
+                for command in [stage["command"]] + ([stage["then"]] if "then" in stage else []):
+                    if subprocess.run([sys.executable] + command, env = env).returncode != 0:
+                        log.error("{}: {} failed".format(name, os.path.basename(command[0])))
+                        return ran
+                outputs = output_hash(stage["outputs"])
+        else:
+            log.info("{}: unchanged".format(name))
+
+        hashes[name] = outputs
+        if not dry_run:
+            state[name] = {"fingerprint": key, "outputs": outputs}
+            save_state(state, args.state)
+        if name == until:
+            break
+    return ran
+
+
+if __name__ == "__main__":
+
+    names = [stage["name"] for stage in stages]
+    for name in args.force + ([args.until] if args.until else []):
+        if name not in names:
+            parser.error("unknown stage {}, expected one of {}".format(name, ", ".join(names)))
+
+    try:
+        ran = run(stages, read_state(args.state), args.force, args.until, args.dry_run)
+    except ValueError as e:
+        log.error(str(e))
+        sys.exit(1)
+    print("{}: {}".format("Would run" if args.dry_run else "Ran",
+                          ", ".join(ran) if ran else "nothing"))
+
+    sys.exit()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Look up values (usually the job title) on individual faculty profile
+pages for schools whose faculty listing leaves them out. Profiles are
+fetched through a bounded thread pool on a shared session and the
+values read from them are kept in an on-disk cache keyed by url, so
+profiles read within the last `ttl` seconds are not fetched again.
+"""
+import os
+import json
+import time
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+
+log = logging.getLogger(__name__)
+
+
+class ProfileCache:
+    """
+    Values read from profile pages, stored in a json file as
+    {url: {"value": ..., "fetched": timestamp}}.
+    --------
+    path (str, json file storing the cache)
+    ttl (int, seconds a value stays valid)
+    """
+
+    def __init__(self, path = "data/profile_cache.json", ttl = 30 * 24 * 3600):
+        self.path = path
+        self.ttl = ttl
+        try:
+            with open(path) as j:
+                self.entries = json.load(j)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def fresh(self, url):
+        entry = self.entries.get(url)
+        return entry is not None and time.time() - entry["fetched"] <= self.ttl
+
+    def get(self, url):
+        return self.entries[url]["value"]
+
+    def put(self, url, value):
+        self.entries[url] = {"value": value, "fetched": time.time()}
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+        with open(self.path + ".tmp", "w") as j:
+            json.dump(self.entries, j)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def lookup(urls, read, session, cache, workers = 8, offline = False):
+    """
+    Return {url: read(html of the profile)} for every url. Values
+    still fresh in `cache` are reused and the others are fetched in
+    parallel. Offline, every cached value is used whatever its age and
+    urls that were never cached are left out, as are profiles that
+    could not be fetched or read; those are logged and not cached.
+    Profiles answering 404 or 410 are kept with the value None.
+    --------
+    urls (list, urls of the profile pages)
+    read (function, html -> value to keep)
+    session (requests.Session, shared session)
+    cache (ProfileCache)
+    workers (int, number of profiles fetched at the same time)
+    offline (bool, only use the cache)
+    """
+    values = {}
+    missing = []
+    for url in dict.fromkeys(urls):
+        if url in cache.entries and (offline or cache.fresh(url)):
+            values[url] = cache.get(url)
+        elif offline:
+            log.info("Profile not cached: {}".format(url))
+        else:
+            missing.append(url)
+
+    def fetch(url):
+        try:
+            r = session.get(url)
+        except requests.exceptions.RequestException as e:
+            log.error("Unable to fetch profile {}: {}".format(url, e))
+            return url, None, False
+        # a profile taken down lists nobody, and is remembered as such
+        if r.status_code in (404, 410):
+            log.error("Profile gone ({}): {}".format(r.status_code, url))
+            return url, None, True
+        if not r.ok:
+            log.error("Unable to fetch profile {}: HTTP {}".format(url, r.status_code))
+            return url, None, False
+        try:
+            return url, read(r.content), True
+        except Exception as e:
+            log.error("Unable to read profile {}: {!r}".format(url, e))
+            return url, None, False
+
+    if missing:
+        try:
+            with ThreadPoolExecutor(max_workers = workers) as pool:
+                for url, value, ok in pool.map(fetch, missing):
+                    if ok:
+                        values[url] = value
+                        cache.put(url, value)
+        finally:
+            cache.save()
+    return values
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Build an SQLite index of the publications listed in the CVs of the
+faculty on the latest crawl of the roster store, one row per
+publication with its author, year, venue and whether it is peer
+reviewed, next to one row per faculty member with the rank and hire
+year read from the CV. Schools are keyed by the names used in
+top25.py, so cohort questions are a single query over indexed tables
+instead of a pass over every CV. The text of the CVs comes from
+extract_text.py.
+"""
+import sys
+import argparse
+import logging
+import os
+import re
+import sqlite3
+import statistics
+import cv_store
+import extract_text
+import metrics
+import name_index
+import roster_store
+from top25 import NRC_2010, USNEWS_2017, top25
+
+
+# set argument parser
+parser = argparse.ArgumentParser(description='Index the publications listed in the CVs.')
+parser.add_argument("-rosters", type = str,
+                    help = "SQLite file of the roster store.",
+                    default = "data/rosters.sqlite")
+parser.add_argument("-namesdir", type = str,
+                    help = "Directory of the json rosters, imported when the roster store has none.",
+                    default = "data/faculty_names")
+parser.add_argument("-storedir", type = str,
+                    help = "Directory of the content-addressed CV store.",
+                    default = "data/cv_store")
+parser.add_argument("-db", type = str,
+                    help = "SQLite file the index is written to.",
+                    default = "data/publications.sqlite")
+parser.add_argument("-match-threshold", type = float,
+                    help = "Lowest score of a roster name matched to a CV of another spelling.",
+                    default = 0.8)
+parser.add_argument("-v", "--verbose",
+                    help = "Set logging level to DEBUG.",
+                    action = "store_true")
+args = parser.parse_args(None if __name__ == "__main__" else [])
+
+
+# set logging
+log = logging.getLogger(__name__)
+log.setLevel(logging.ERROR)
+if args.verbose:
+    log.setLevel(logging.DEBUG)
+loghandler = logging.StreamHandler(sys.stderr)
+loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+log.addHandler(loghandler)
+
+
+schema = """
+CREATE TABLE schools (
+    school TEXT PRIMARY KEY,
+    nrc_2010 INTEGER,
+    usnews_2017 INTEGER,
+    top25 INTEGER NOT NULL
+);
+CREATE TABLE faculty (
+    school TEXT NOT NULL REFERENCES schools(school),
+    name TEXT NOT NULL,
+    cv_key TEXT NOT NULL,
+    cv_match REAL,
+    cv_sha256 TEXT,
+    rank TEXT,
+    hire_year INTEGER,
+    PRIMARY KEY (school, name)
+);
+CREATE TABLE publications (
+    school TEXT NOT NULL,
+    name TEXT NOT NULL,
+    year INTEGER,
+    venue TEXT,
+    peer_reviewed INTEGER,
+    forthcoming INTEGER NOT NULL,
+    section TEXT,
+    citation TEXT NOT NULL,
+    FOREIGN KEY (school, name) REFERENCES faculty(school, name)
+);
+CREATE INDEX publications_author ON publications(school, name);
+CREATE INDEX publications_year ON publications(year);
+CREATE INDEX publications_peer_reviewed ON publications(peer_reviewed, school);
+"""
+
+# section headings, tried in this order
+skip_section = re.compile(r"working|under review|in progress|in preparation|"
+                          r"submitted|manuscripts?\b|dissertation", re.I)
+end_section = re.compile(r"education|teaching|courses|awards?\b|grants?\b|fellowships?|"
+                         r"scholarships?|honors|presentations|presented|talks|conferences?|"
+                         r"service|media|blog|employment|appointments?|positions?|"
+                         r"references|languages|skills|interests|specialt|affiliations|"
+                         r"experience|memberships", re.I)
+other_section = re.compile(r"non-?\s?refereed|not peer|non-peer|\bchapters?\b|\bbooks?\b|"
+                           r"edited volumes?|\breviews\b|encyclopedia|"
+                           r"other publications|policy|op-?eds?\b|popular", re.I)
+peer_section = re.compile(r"journal|refereed|peer[- ]reviewed", re.I)
+generic_section = re.compile(r"publications|articles|research|papers", re.I)
+
+year = re.compile(r"(?<!\d)(?:19|20)\d\d(?!\d)")
+year_in_parens = re.compile(r"\(((?:19|20)\d\d)[a-z]?\)")
+quoted_title = re.compile(r"[“\"](.+?)[”\"]", re.S)
+venue_after_title = re.compile(
+    r"^[\s,.]*(?:\([^)]*\)[\s,.]*)?(?:(?:19|20)\d\d[a-z]?[\s,.]*)?(?:In:?\s+)?"
+    r"([A-Z][^.\d(:;]+)")
+forthcoming = re.compile(r"forthcoming|in press|accepted", re.I)
+not_peer_reviewed = re.compile(r"^In\s|\beds?\.|\(eds?\)|\bPress\b")
+bullet = re.compile(r"^\s*(?:[•●▪◦■\-–*]|\d+\.)\s+", re.M)
+hyphen_break = re.compile(r"-\n(?=[a-z])")
+
+# faculty position and its years, on one line or the next
+position = re.compile(
+    r"(?P<rank>Assistant|Associate)\s+Professor\b[^\n]*(?:\n[^\n]*)??"
+    r"(?P<start>(?:19|20)\d\d)\s*(?:[-–—]+|to)\s*(?P<end>(?:19|20)\d\d|present|current|now)?"
+    r"|(?P<start2>(?:19|20)\d\d)\s*(?:[-–—]+|to)\s*(?P<end2>(?:19|20)\d\d|present|current|now)?"
+    r"[\s,:]*(?P<rank2>Assistant|Associate)\s+Professor\b", re.I)
+
+# journals that are peer reviewed wherever they are listed
+journals = [
+    "American Political Science Review", "American Journal of Political Science",
+    "Journal of Politics", "World Politics", "International Organization",
+    "Comparative Political Studies", "British Journal of Political Science",
+    "Quarterly Journal of Political Science", "Political Analysis",
+    "Perspectives on Politics", "Annual Review of Political Science",
+    "International Studies Quarterly", "Journal of Conflict Resolution",
+    "Legislative Studies Quarterly", "Political Behavior", "Public Opinion Quarterly",
+    "Journal of Theoretical Politics", "Political Theory", "Comparative Politics",
+    "Studies in Comparative International Development", "Latin American Research Review",
+    "International Security", "Security Studies", "Journal of Peace Research",
+    "Electoral Studies", "Political Science Research and Methods",
+    "Journal of Experimental Political Science", "Political Research Quarterly",
+    "Research & Politics", "Research and Politics", "Journal of Democracy", "Polity",
+    "PS: Political Science & Politics", "Political Psychology", "Political Communication",
+    "European Journal of Political Research", "Journal of Law, Economics, and Organization",
+    "Journal of Public Economics", "American Economic Review",
+    "Quarterly Journal of Economics", "Econometrica",
+    "Proceedings of the National Academy of Sciences"]
+journal = re.compile(r"\b(?:{})\b".format("|".join(
+    re.escape(j) for j in sorted(journals, key = len, reverse = True))))
+
+
+def read_rosters(rosters, store, threshold = 0.8):
+    """
+    Yield (school, name, cv key, match score) for every faculty member
+    on the latest crawl, pages of the same school merged. The CV is the
+    one saved under the name, as in download.cv_path, else the CV whose
+    key best matches the name; the score is None when none does.
+    --------
+    rosters (roster_store.RosterStore)
+    store (cv_store.CVStore)
+    threshold (float, lowest score of a match)
+    """
+    index = name_index.NameIndex((key, key) for key in store.index)
+    for school, _, name in rosters.roster():
+        key = name.replace(" ", "").replace(".", "")
+        score = 1.0
+        if key not in store.index:
+            match, score = index.best(name, threshold)
+            if match is None:
+                score = None
+            else:
+                log.info("CV of {} matched to {} ({})".format(name, match, score))
+                key = match
+        yield school, name, key, score
+
+
+def classify(line):
+    """
+    Kind of section a line of the CV opens: "skip", "other", "peer",
+    "generic", "end", or None if the line is not a heading.
+    --------
+    line (str, line of the CV)
+    """
+    line = line.strip().rstrip(":")
+    if (not line or len(line) > 60 or len(line.split()) > 7 or not line[0].isupper()
+            or line[-1] in ".,;" or re.search(r"\d|\bof\b", line)):
+        return None
+    for kind, pattern in (("skip", skip_section), ("end", end_section),
+                          ("other", other_section), ("peer", peer_section),
+                          ("generic", generic_section)):
+        if pattern.search(line):
+            return kind
+    return None
+
+
+def sections(text):
+    """
+    Yield (heading, kind, body) for the publication sections of a CV.
+    --------
+    text (str, text of the CV)
+    """
+    heading, kind, body = None, None, []
+    for line in text.splitlines():
+        new = classify(line)
+        if new is None:
+            if kind is not None:
+                body.append(line)
+            continue
+        if kind in ("peer", "other", "generic"):
+            yield heading, kind, "\n".join(body)
+        heading, kind, body = line.strip().rstrip(":"), new, []
+        if kind in ("skip", "end"):
+            kind = None
+    if kind in ("peer", "other", "generic"):
+        yield heading, kind, "\n".join(body)
+
+
+def entries(body):
+    """
+    Split a section into citations, on blank lines and bullets. Page
+    headers and other fragments without a year are dropped.
+    --------
+    body (str, text of the section)
+    """
+    body = bullet.sub("\n\n", hyphen_break.sub("", body))
+    for chunk in re.split(r"\n\s*\n", body):
+        citation = " ".join(chunk.split())
+        if len(citation) >= 20 and (year.search(citation) or forthcoming.search(citation)):
+            yield citation
+
+
+def parse_citation(citation, kind):
+    """
+    (year, venue, peer_reviewed, forthcoming) of one citation.
+    --------
+    citation (str, citation on one line)
+    kind (str, kind of the section it is listed in)
+    """
+    title = quoted_title.search(citation)
+    rest = citation[title.end():] if title else citation
+    found = year_in_parens.search(citation)
+    if found:
+        year_ = int(found.group(1))
+    else:
+        found = year.search(quoted_title.sub("", citation))
+        year_ = int(found.group()) if found else None
+
+    found = journal.search(rest)
+    if found:
+        venue = found.group()
+    else:
+        found = venue_after_title.search(rest) if title else None
+        venue = found.group(1).strip(" ,") if found else None
+
+    if kind == "peer":
+        peer_reviewed = 1
+    elif kind == "other":
+        peer_reviewed = 0
+    elif journal.search(rest):
+        peer_reviewed = 1
+    elif not_peer_reviewed.search(rest.strip()):
+        peer_reviewed = 0
+    else:
+        peer_reviewed = None
+    return year_, venue, peer_reviewed, int(bool(forthcoming.search(citation)))
+
+
+def read_position(text):
+    """
+    (rank, hire year) read from the appointments in a CV: the rank of
+    the latest assistant/associate professor position and the year the
+    first one started. (None, None) if the CV lists none.
+    --------
+    text (str, text of the CV)
+    """
+    positions = []
+    for m in position.finditer(text):
+        rank = (m.group("rank") or m.group("rank2")).title() + " Professor"
+        positions.append((int(m.group("start") or m.group("start2")), rank))
+    if not positions:
+        return None, None
+    return max(positions)[1], min(positions)[0]
+
+
+def build(db, rosters, store, threshold = 0.8):
+    """
+    Rebuild the index from the rosters and the extracted CV text. The
+    new database is written next to `db` and moved over it at the end.
+    --------
+    db (str, SQLite file)
+    rosters (roster_store.RosterStore)
+    store (cv_store.CVStore)
+    threshold (float, lowest score of a name matched to a CV)
+    """
+    if os.path.dirname(db):
+        os.makedirs(os.path.dirname(db), exist_ok = True)
+    tmp = db + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    conn.executescript(schema)
+
+    schools = set(NRC_2010) | set(USNEWS_2017)
+    faculty = {}
+    for school, name, key, score in read_rosters(rosters, store, threshold):
+        faculty.setdefault((school, name), (key, score))
+        schools.add(school)
+    conn.executemany("INSERT INTO schools VALUES (?, ?, ?, ?)", [
+        (s, NRC_2010.index(s) + 1 if s in NRC_2010 else None,
+         USNEWS_2017.index(s) + 1 if s in USNEWS_2017 else None, int(s in top25))
+        for s in sorted(schools)])
+
+    rows = []
+    publications = []
+    for (school, name), (key, score) in faculty.items():
+        sha256 = store.current(key)
+        rank = hire_year = None
+        path = extract_text.text_path(store, sha256) if sha256 else None
+        if path and os.path.exists(path):
+            with open(path) as t:
+                text = t.read()
+            rank, hire_year = read_position(text)
+            for heading, kind, body in sections(text):
+                for citation in entries(body):
+                    publications.append((school, name) + parse_citation(citation, kind)
+                                        + (heading, citation))
+        else:
+            log.info("No CV text for {} ({})".format(name, school))
+        rows.append((school, name, key, score, sha256, rank, hire_year))
+    conn.executemany("INSERT INTO faculty VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.executemany("INSERT INTO publications VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                     publications)
+    conn.commit()
+    conn.close()
+    os.replace(tmp, db)
+    log.info("{} faculty, {} publications".format(len(rows), len(publications)))
+
+
+def peer_reviewed_at_hire(conn, rank = "Assistant Professor", top25_only = True):
+    """
+    {(school, name): number of peer-reviewed publications dated up to
+    the hire year} for faculty of `rank` whose hire year is known.
+    --------
+    conn (sqlite3.Connection, open index)
+    rank (str, "Assistant Professor" or "Associate Professor")
+    top25_only (bool, only schools in top25.top25)
+    """
+    rows = conn.execute("""
+        SELECT f.school, f.name, COUNT(p.year)
+        FROM faculty f
+        JOIN schools s ON s.school = f.school
+        LEFT JOIN publications p
+            ON p.school = f.school AND p.name = f.name
+            AND p.peer_reviewed = 1 AND p.year <= f.hire_year
+        WHERE f.rank = ? AND f.hire_year IS NOT NULL AND s.top25 >= ?
+        GROUP BY f.school, f.name""", (rank, int(top25_only)))
+    return {(school, name): n for school, name, n in rows}
+
+
+if __name__ == "__main__":
+
+    store = cv_store.CVStore(args.storedir)
+    with metrics.stage("counts"):
+        build(args.db, roster_store.open_store(args.rosters, args.namesdir), store, args.match_threshold)
+
+    conn = sqlite3.connect(args.db)
+    for rank in ("Assistant Professor", "Associate Professor"):
+        counts = peer_reviewed_at_hire(conn, rank)
+        if counts:
+            print("{}: median {} peer-reviewed publications at hire ({} faculty)".format(
+                rank, statistics.median(counts.values()), len(counts)))
+    conn.close()
+
+    sys.exit()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Academic rank of the titles on the faculty pages. One regular
+expression with a named group per rank reads every rank a text holds
+in a single scan, so a page is not scanned once per rank: assistant
+(including "Assistant Teaching Professor"), associate, full, adjunct,
+emeritus and lecturer. Texts without "Profess", "Lectur" or "Emerit"
+are skipped before the expression runs, and each distinct text is
+read once however many parsers ask about it.
+`ranked` finds the titles of every rank, so the parsers read a page
+once for the whole faculty, and `junior` is what get_junior_faculty.py
+keeps of them: the titles the former title_pattern matched, i.e.
+assistant professors, adjunct and visiting ones included, and
+associate professors whose title follows other text and does not start
+with "Adjunct", so the rosters stay as they were.
+"""
+import re
+import sys
+
+
+rank_pattern = re.compile(r"""
+    (?P<emeritus>\bProfessor\s+Emerit(?:us|a)\b|\bEmerit(?:us|a)\b)
+  | (?P<adjunct>\bAdjunct\s(?:(?P<adjunct_assistant>Assistant\s)|Associate\s)?Professor)
+  | (?P<assistant>Assistant\s(?:Teaching\s)?Professor)
+  | (?P<associate>(?:(?<!Adjunct)(?P<spaced>\s))?\bAssociate\s(?P<teaching>Teaching\s)?Professor)
+  | (?P<lecturer>\b(?:Senior\s+)?Lecturer\b)
+  | (?P<full>\bProfessor\b)
+""", re.X)
+
+# the rank of a text listing several, e.g. "Associate Professor Emeritus"
+priority = ["emeritus", "adjunct", "lecturer", "assistant", "associate", "full"]
+
+# the rank of a person listed with several titles: a named chair ("Early
+# Career Professor") or a sentence about them does not outrank their own
+# title, and an adjunct appointment elsewhere comes last
+person_priority = ["emeritus", "assistant", "associate", "lecturer", "full", "adjunct"]
+
+
+def person_rank(ranks):
+    """
+    Rank of a person from the ranks of all the titles listed for them.
+    --------
+    ranks (set, ranks of the titles)
+    """
+    return next(r for r in person_priority if r in ranks)
+
+
+def person(name):
+    """
+    Whether `name` reads as a person's name rather than a heading,
+    menu entry or address, e.g. "PEOPLE" or "lparsons@tamu.edu".
+    --------
+    name (str, name read off a page)
+    """
+    return name is not None and len(name.split()) > 1 and "@" not in name
+
+
+def scan(text):
+    """
+    (ranks, junior) of `text`: the set of ranks it names and whether
+    it is a junior title.
+    --------
+    text (str, text node or title)
+    """
+    ranks = set()
+    junior = False
+    for m in rank_pattern.finditer(text):
+        rank = m.lastgroup
+        ranks.add(rank)
+        junior = junior or rank == "assistant" or (
+            rank == "adjunct" and m.group("adjunct_assistant") is not None) or (
+            rank == "associate" and m.group("spaced") is not None
+            and m.group("teaching") is None)
+    return ranks, junior
+
+
+class Titles:
+    """
+    Memo of scan() by text. `search` and calling it make it usable
+    wherever a compiled title pattern was, including BeautifulSoup's
+    find_all(string = ...): both are true for junior titles only, or
+    for the titles of any rank if `every`.
+    The memo starts over once it holds `size` texts, so a page listing
+    thousands of names does not keep every one of them.
+    --------
+    size (int, most texts remembered)
+    every (bool, match the titles of every rank)
+    """
+
+    def __init__(self, size = 10000, every = False):
+        self.size = size
+        self.every = every
+        self.seen = {}
+
+    def read(self, text):
+        found = self.seen.get(text)
+        if found is None:
+            if "Profess" in text or "Lectur" in text or "Emerit" in text:
+                found = scan(text)
+            else:
+                found = (frozenset(), False)
+            if len(self.seen) >= self.size:
+                self.seen.clear()
+            self.seen[text] = found
+        return found
+
+    def search(self, text):
+        return self.matches(text) or None
+
+    def __call__(self, text):
+        return text is not None and self.matches(text)
+
+    def matches(self, text):
+        ranks, junior = self.read(text)
+        return bool(ranks) if self.every else junior
+
+    def junior(self, text):
+        """
+        Whether `text` is a junior title.
+        --------
+        text (str, text node or title)
+        """
+        return self.read(text)[1]
+
+    def ranks(self, text):
+        """
+        Set of the ranks `text` names.
+        --------
+        text (str, text node or title)
+        """
+        return self.read(text)[0]
+
+    def rank(self, text):
+        """
+        Rank of `text`, the most specific when it names several, None
+        when it names none.
+        --------
+        text (str, text node or title)
+        """
+        ranks = self.read(text)[0]
+        return next((r for r in priority if r in ranks), None)
+
+
+junior = Titles()
+ranked = Titles(every = True)
+
+
+if __name__ == "__main__":
+
+    # compare with the former title_pattern on the text of the saved pages
+    import glob
+    import timeit
+    import extract
+
+    title_pattern = re.compile(r"Assistant\s(?=Professor)|(?<!Adjunct)\sAssociate\s(?=Professor)"
+                               r"|Assistant\s(?=Teaching\sProfessor)")
+    texts = []
+    for file in sorted(glob.glob(sys.argv[1] + "/*.html" if len(sys.argv) > 1
+                                 else "data/faculty_page/*.html")):
+        with open(file) as h:
+            texts.extend(text for kind, text, _ in extract.walk(extract.roots(h.read()))
+                         if kind != "tag")
+
+    titles = Titles()
+    differ = [t for t in texts if bool(title_pattern.search(t)) != bool(titles.search(t))]
+    print("{} text nodes, {} classified differently".format(len(texts), len(differ)))
+    # one pass over every text node, the memo starting empty
+    before = min(timeit.repeat(lambda: [title_pattern.search(t) for t in texts],
+                               number = 1, repeat = 5))
+    after = min(timeit.repeat(lambda: [titles.search(t) for t in texts],
+                              setup = lambda: globals().update(titles = Titles()),
+                              number = 1, repeat = 5))
+    print("title_pattern {:.4f}s, ranks {:.4f}s".format(before, after))
+    counts = {}
+    for t in texts:
+        rank = titles.rank(t)
+        counts[rank] = counts.get(rank, 0) + 1
+    print(counts)
+
+    sys.exit()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Replay the archived responses from a local HTTP server so the fetching
+code can be load tested without a network. The server answers for
+- the faculty pages in data/faculty_page, at their original urls (the
+  first page from data/faculty_page_links.json, the next ones from the
+  pager of the page before),
+- the CVs in data/faculty_cv, at the urls they were downloaded from
+  when the CV store or the batch results know them, and always at
+  http://replay.local/cv/<file>,
+- every response kept in the HTTP cache,
+- the Emory and Rochester profiles, rebuilt from the titles in the
+  profile cache,
+with the headers saved next to each body. Validators and ranges are
+honoured. Latency, bandwidth, error answers and cut transfers are
+configurable. The scripts reach the server through ReplayAdapter,
+which sends each request to the server with the original url in the
+path, e.g. http://127.0.0.1:8800/https/polisci.duke.edu/people/faculty,
+while the scheduler still limits it by its original host.
+"""
+import sys
+import argparse
+import logging
+import os
+import re
+import csv
+import json
+import time
+import random
+import threading
+from html import escape
+from email.utils import parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, urldefrag
+import requests
+import scheduler
+import extract
+
+
+log = logging.getLogger(__name__)
+
+synthetic = "http://replay.local/cv/"
+
+# headers that describe the original transfer, not the body
+hop_headers = {"connection", "keep-alive", "transfer-encoding", "content-encoding",
+               "content-length", "content-range", "set-cookie",
+               "strict-transport-security"}
+
+profile_pages = {
+    "emory.edu": '<html><body><h4 itemprop="jobTitle">{}</h4></body></html>',
+    "rochester.edu": '<html><body><div id="content">'
+                     '<p class="faculty-profile-information-title">{}</p></div></body></html>'}
+
+# profile of which no title was cached
+stub_profile = b"<html><body><p>Profile not archived.</p></body></html>"
+
+
+def rewrite(url, server):
+    """
+    Url of `url` on the replay server.
+    --------
+    url (str, original url)
+    server (str, base url of the replay server)
+    """
+    parts = urlsplit(url)
+    return "{}/{}/{}{}".format(server.rstrip("/"), parts.scheme, parts.netloc,
+                               url[len(parts.scheme) + 3 + len(parts.netloc):] or "/")
+
+
+def original(path):
+    """
+    Original url of a path on the replay server, inverse of rewrite().
+    --------
+    path (str, request path)
+    """
+    scheme, _, rest = path.lstrip("/").partition("/")
+    return "{}://{}".format(scheme, rest)
+
+
+class Rewriting(requests.adapters.HTTPAdapter):
+    """
+    Sends requests to the replay server and puts the original url back
+    on the response.
+    """
+
+    def send(self, request, **kwargs):
+        replayed = request.copy()
+        replayed.url = rewrite(request.url, self.server)
+        r = super().send(replayed, **kwargs)
+        r.url = request.url
+        r.request = request
+        return r
+
+
+class ReplayAdapter(scheduler.PoliteAdapter, Rewriting):
+    """
+    PoliteAdapter whose requests go to the replay server.
+    --------
+    server (str, base url of the replay server)
+    scheduler (scheduler.Scheduler)
+    """
+
+    def __init__(self, server, scheduler = None, **kwargs):
+        self.server = server
+        super().__init__(scheduler, **kwargs)
+
+
+def make_session(pool_size, server, scheduler = None):
+    """
+    scheduler.make_session() for a session that replays from `server`.
+    --------
+    pool_size (int, number of connections kept open per host)
+    server (str, base url of the replay server)
+    scheduler (scheduler.Scheduler, default: the shared one)
+    """
+    s = requests.Session()
+    adapter = ReplayAdapter(server, scheduler, pool_connections = pool_size,
+                            pool_maxsize = pool_size)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def read_json(path, default):
+    try:
+        with open(path) as j:
+            return json.load(j)
+    except (OSError, ValueError):
+        return default
+
+
+def page_routes(pagedir, links, sites):
+    """
+    {url: (body file, headers)} of the saved faculty pages.
+    --------
+    pagedir (str, directory of the saved pages)
+    links (dict, school name -> url of its first page)
+    sites (dict, school name -> extract.Site)
+    """
+    routes = {}
+    for school, url in links.items():
+        site = sites.get(school)
+        base = "" if site is not None and site.next_base == "" else url
+        count = 0
+        while url is not None:
+            path = os.path.join(pagedir, "{}_faculty_page{}".format(
+                school.replace(" ", "_"), count))
+            if not os.path.exists(path + ".html"):
+                break
+            headers = read_json(path + ".json", {})
+            # get_html saved the header as "last modified"
+            if headers.get("last modified"):
+                headers["last-modified"] = headers.pop("last modified")
+            routes[url] = (path + ".html", headers)
+            with open(path + ".html") as h:
+                ahead = extract.pages_ahead(h.read())
+            url = base + ahead[0] if ahead else None
+            count += 1
+    return routes
+
+
+def cv_routes(cvdir, storedir, results):
+    """
+    {url: (body file, headers)} of the saved CVs.
+    --------
+    cvdir (str, directory of the saved CVs)
+    storedir (str, directory of the CV store)
+    results (str, jsonl results of the batch downloads)
+    """
+    urls = {}
+    for key, entry in read_json(os.path.join(storedir, "index.json"), {}).items():
+        for version in entry["history"]:
+            if version.get("url") and version.get("file"):
+                urls.setdefault(version["file"], set()).add(version["url"])
+    if os.path.exists(results):
+        with open(results) as f:
+            for line in f:
+                result = json.loads(line)
+                if result.get("file") and result.get("url"):
+                    urls.setdefault(os.path.basename(result["file"]), set()).add(result["url"])
+
+    routes = {}
+    for file in sorted(os.listdir(cvdir)):
+        key, ext = os.path.splitext(file)
+        if ext not in (".pdf", ".html", "") or file.startswith("."):
+            continue
+        headers = read_json(os.path.join(cvdir, key + ".json"), {})
+        for url in urls.get(file, set()) | {synthetic + file}:
+            routes[url] = (os.path.join(cvdir, file), headers)
+    return routes
+
+
+def cache_routes(cachedir):
+    """
+    {url: (body file, headers)} of the responses in the HTTP cache.
+    --------
+    cachedir (str, directory of the HTTP cache)
+    """
+    import http_cache
+    cache = http_cache.HTTPCache(cachedir)
+    return {url: (cache.bodyfile(url), entry["headers"])
+            for url, entry in cache.index.items()
+            if os.path.exists(cache.bodyfile(url))}
+
+
+def profile_routes(profilecache, pagedir, sites):
+    """
+    {url: (html, headers)} of profile pages rebuilt from the titles
+    kept in the profile cache. Profiles linked from the saved listing
+    pages but not cached are served a stub without a title, which the
+    crawler logs and skips, leaving that school's roster as it was.
+    --------
+    profilecache (str, json file of the profile cache)
+    pagedir (str, directory of the saved pages)
+    sites (dict, school name -> extract.Site)
+    """
+    headers = {"content-type": "text/html; charset=utf-8"}
+    routes = {}
+    for school, site in sites.items():
+        path = os.path.join(pagedir, "{}_faculty_page0.html".format(school.replace(" ", "_")))
+        if site.profiles and os.path.exists(path):
+            with open(path) as h:
+                for _, url in site.links(h.read()):
+                    routes[url] = (stub_profile, headers)
+    for url, entry in read_json(profilecache, {}).items():
+        for domain, page in profile_pages.items():
+            if domain in url and entry.get("value") is not None:
+                routes[url] = (page.format(escape(entry["value"])).encode(), headers)
+    return routes
+
+
+class Replay(BaseHTTPRequestHandler):
+    """
+    Serves `routes` of the server, {url: (file or bytes, headers)}.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.do_GET(body = False)
+
+    def do_GET(self, body = True):
+        config = self.server.config
+        url = original(self.path)
+        route = self.server.routes.get(url)
+        time.sleep(max(0, config.latency + random.uniform(-config.jitter, config.jitter)))
+        if route is None:
+            return self.reply(404, {}, b"", body)
+        if random.random() < config.error_rate:
+            headers = {"Retry-After": str(config.retry_after)} if config.retry_after else {}
+            return self.reply(config.error_status, headers, b"", body)
+
+        content, headers = route
+        if isinstance(content, str):
+            with open(content, "rb") as f:
+                content = f.read()
+        headers = {k: v for k, v in headers.items()
+                   if v is not None and k.lower() not in hop_headers}
+        lower = {k.lower(): v for k, v in headers.items()}
+        if self.not_modified(lower):
+            return self.reply(304, headers, b"", body)
+
+        status = 200
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if match and (if_range is None or if_range in (lower.get("etag"),
+                                                       lower.get("last-modified"))):
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(content) - 1
+            if start >= len(content):
+                return self.reply(416, {"Content-Range": "bytes */{}".format(len(content))},
+                                  b"", body)
+            headers["Content-Range"] = "bytes {}-{}/{}".format(start, end, len(content))
+            content = content[start:end + 1]
+            status = 206
+        headers["Accept-Ranges"] = "bytes"
+        self.reply(status, headers, content, body,
+                   truncate = random.random() < config.truncate_rate)
+
+    def not_modified(self, headers):
+        etag = self.headers.get("If-None-Match")
+        if etag is not None:
+            return etag == headers.get("etag")
+        since = self.headers.get("If-Modified-Since")
+        if since and headers.get("last-modified"):
+            try:
+                return parsedate_to_datetime(headers["last-modified"]) <= \
+                    parsedate_to_datetime(since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def reply(self, status, headers, content, body = True, truncate = False):
+        """
+        Send the answer at the configured bandwidth, cutting it off
+        half way if `truncate`.
+        """
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(content)))
+        if truncate:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        if not body:
+            return
+        sent = 0
+        limit = len(content) // 2 if truncate else len(content)
+        chunk = 16 * 1024
+        bandwidth = self.server.config.bandwidth * 1024
+        while sent < limit:
+            piece = content[sent:min(sent + chunk, limit)]
+            self.wfile.write(piece)
+            sent += len(piece)
+            if bandwidth:
+                time.sleep(len(piece) / bandwidth)
+        if truncate:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        log.info("%s %s", self.address_string(), format % args)
+
+
+def serve(routes, config, port = 8800, host = "127.0.0.1"):
+    """
+    Start the replay server in a background thread and return it.
+    --------
+    routes (dict, url -> (file or bytes, headers))
+    config (argparse.Namespace, latency, jitter, bandwidth, error_rate,
+            error_status, retry_after, truncate_rate)
+    port (int, port to listen on, 0 for any)
+    host (str, address to listen on)
+    """
+    server = ThreadingHTTPServer((host, port), Replay)
+    server.daemon_threads = True
+    # fragments never reach the server
+    server.routes = {urldefrag(url)[0]: route for url, route in routes.items()}
+    server.config = config
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+    return server
+
+
+# set argument parser
+parser = argparse.ArgumentParser(description='Serve the archived pages and CVs locally.')
+parser.add_argument("-port", type = int, help = "Port to listen on.", default = 8800)
+parser.add_argument("-pagedir", type = str,
+                    help = "Directory of the saved faculty pages.",
+                    default = "data/faculty_page")
+parser.add_argument("-links", type = str,
+                    help = "Json file of the first faculty page of each school.",
+                    default = "data/faculty_page_links.json")
+parser.add_argument("-specs", type = str,
+                    help = "Json file of the page layout of each school, for the pagers.",
+                    default = "data/site_specs.json")
+parser.add_argument("-cvdir", type = str,
+                    help = "Directory of the saved CVs.",
+                    default = "data/faculty_cv")
+parser.add_argument("-storedir", type = str,
+                    help = "Directory of the CV store, for the CV urls.",
+                    default = "data/cv_store")
+parser.add_argument("-results", type = str,
+                    help = "Jsonl results of the batch downloads, for the CV urls.",
+                    default = "data/cv_download_results.jsonl")
+parser.add_argument("-cachedir", type = str,
+                    help = "Directory of the HTTP cache.",
+                    default = "data/http_cache")
+parser.add_argument("-profilecache", type = str,
+                    help = "Json file of the profile titles.",
+                    default = "data/profile_cache.json")
+parser.add_argument("-latency", type = float,
+                    help = "Seconds before each answer.", default = 0)
+parser.add_argument("-jitter", type = float,
+                    help = "Random seconds added to or taken from the latency.", default = 0)
+parser.add_argument("-bandwidth", type = float,
+                    help = "KB per second of each transfer, 0 for no limit.", default = 0)
+parser.add_argument("-error-rate", type = float,
+                    help = "Share of requests answered with -error-status.", default = 0)
+parser.add_argument("-error-status", type = int,
+                    help = "Status of the injected errors.", default = 503)
+parser.add_argument("-retry-after", type = int,
+                    help = "Retry-After seconds sent with the injected errors.")
+parser.add_argument("-truncate-rate", type = float,
+                    help = "Share of transfers cut off half way.", default = 0)
+parser.add_argument("-seed", type = int, help = "Seed of the injected faults.")
+parser.add_argument("-manifest", type = str,
+                    help = "Write a download_cv.py manifest of the replayed CVs to this csv.")
+parser.add_argument("-v", "--verbose",
+                    help = "Set logging level to DEBUG.",
+                    action = "store_true")
+
+
+if __name__ == "__main__":
+
+    args = parser.parse_args()
+
+    # set logging
+    log.setLevel(logging.ERROR)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    loghandler = logging.StreamHandler(sys.stderr)
+    loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    log.addHandler(loghandler)
+
+    random.seed(args.seed)
+    routes = {}
+    if os.path.isdir(args.cachedir):
+        routes.update(cache_routes(args.cachedir))
+    sites = extract.load_sites(args.specs)
+    routes.update(profile_routes(args.profilecache, args.pagedir, sites))
+    routes.update(page_routes(args.pagedir, read_json(args.links, {}), sites))
+    routes.update(cv_routes(args.cvdir, args.storedir, args.results))
+
+    if args.manifest:
+        with open(args.manifest, "w", newline = "") as f:
+            writer = csv.writer(f)
+            writer.writerow(["name", "url"])
+            for url in sorted(routes):
+                if url.startswith(synthetic):
+                    writer.writerow([os.path.splitext(url[len(synthetic):])[0], url])
+
+    server = serve(routes, args, args.port)
+    print("Replaying {} urls on http://127.0.0.1:{}".format(len(routes), args.port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+    sys.exit()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite store of the junior faculty rosters, one row per person, school
+and crawl, keyed by a normalized form of the name, next to the rank of
+everyone with a rank on the same pages for tenure analysis. get_junior_faculty.py
+writes the rosters of each crawl in one transaction once its pages are
+parsed, so the other scripts read every roster with one query instead
+of opening the json file of each school and page, a person is found
+through an index whatever page or school they are on, and what changed
+between two crawls is a query. Names that are missing or listed twice
+on the pages of a school are reported instead of stored.
+Run as a script to import a directory of rosters, look up a person or
+compare two crawls.
+"""
+import sys
+import argparse
+import logging
+import os
+import re
+import json
+import time
+import sqlite3
+import unicodedata
+
+
+log = logging.getLogger(__name__)
+
+schema = """
+CREATE TABLE IF NOT EXISTS crawls (
+    crawl INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    source TEXT,
+    names INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rosters (
+    crawl INTEGER NOT NULL REFERENCES crawls (crawl),
+    school TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    PRIMARY KEY (crawl, school, key)
+);
+CREATE INDEX IF NOT EXISTS rosters_key ON rosters (key, crawl);
+CREATE TABLE IF NOT EXISTS faculty (
+    crawl INTEGER NOT NULL REFERENCES crawls (crawl),
+    school TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    rank TEXT NOT NULL,
+    PRIMARY KEY (crawl, school, key)
+);
+CREATE INDEX IF NOT EXISTS faculty_rank ON faculty (crawl, rank);
+"""
+
+
+def normalize(name):
+    """
+    Key of a name: accents, punctuation, case and spacing left out, so
+    "Kerry L. Haynie" and "kerry l haynie" are the same person.
+    --------
+    name (str, name as it appears on the roster)
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s-]", " ", name.casefold()).split())
+
+
+def school_page(file):
+    """
+    School, as spelled in top25.py, and page number of a roster file.
+    --------
+    file (str, file name in data/faculty_names, e.g. HARVARD_UNIVERSITY2.json)
+    """
+    stem = os.path.splitext(file)[0]
+    match = re.search(r"\d+$", stem)
+    return (stem[:match.start()] if match else stem).replace("_", " "), \
+        int(match.group()) if match else 0
+
+
+def read_dir(namedir):
+    """
+    Yield (school, page, names) for every roster file in `namedir`,
+    names being [name, rank] in the rank rosters.
+    --------
+    namedir (str, directory storing the json rosters)
+    """
+    for file in sorted(os.listdir(namedir)):
+        if not file.endswith(".json"):
+            continue
+        with open(os.path.join(namedir, file)) as j:
+            names = json.load(j)
+        yield school_page(file) + (names,)
+
+
+def open_store(path = "data/rosters.sqlite", namedir = None):
+    """
+    The roster store at `path`. A store without any crawl, e.g. before
+    get_junior_faculty.py first wrote one, is filled with the json
+    rosters of `namedir` as they were saved before the store existed.
+    --------
+    path (str, SQLite file)
+    namedir (str, directory storing the json rosters)
+    """
+    store = RosterStore(path)
+    if store.crawl() is None and namedir and os.path.isdir(namedir):
+        log.warning("No crawl in {}, importing the rosters of {}".format(path, namedir))
+        store.write(read_dir(namedir), source = "import")
+    if store.crawl() is None:
+        log.error("No rosters in {}{}".format(path, " nor {}".format(namedir) if namedir else ""))
+    return store
+
+
+class RosterStore:
+    """
+    --------
+    path (str, SQLite file)
+    """
+
+    def __init__(self, path = "data/rosters.sqlite"):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(schema)
+
+    def write(self, rosters, date = None, source = None, ranks = None):
+        """
+        Store the rosters of one run as a new crawl, next to any other
+        crawl or reparse of the same date, and return its id.
+        --------
+        rosters (iterable, (school, page, names) for every page)
+        date (str, date of the crawl, default: today)
+        source (str, what produced the rosters, e.g. "crawl" or "reparse")
+        ranks (iterable, (school, page, [(name, rank)]) for every page)
+        """
+        date = date or time.strftime("%Y-%m-%d")
+        rows = {}
+        for school, page, names in rosters:
+            for position, name in enumerate(names):
+                if not name or not name.strip():
+                    log.warning("Missing name at {} of {} page {}".format(
+                        position, school, page))
+                    continue
+                key = normalize(name)
+                if (school, key) in rows:
+                    log.warning("{} listed twice by {} (pages {} and {})".format(
+                        name.strip(), school, rows[(school, key)][1], page))
+                    continue
+                rows[(school, key)] = (school, page, position, name.strip(), key)
+        with self.conn:
+            crawl = self.conn.execute("INSERT INTO crawls (date, source, names) VALUES (?, ?, ?)",
+                                      (date, source, len(rows))).lastrowid
+            self.conn.executemany("INSERT INTO rosters VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(crawl,) + row for row in rows.values()])
+            self.conn.executemany("INSERT OR IGNORE INTO faculty VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  [(crawl, school, page, position, name.strip(), normalize(name), rank)
+                                   for school, page, ranked in ranks or ()
+                                   for position, (name, rank) in enumerate(ranked)
+                                   if name and name.strip()])
+        log.info("Stored {} names from the crawl of {}".format(len(rows), date))
+        return crawl
+
+    def crawls(self):
+        """
+        [(crawl, date, source, names)] from the oldest crawl on.
+        """
+        return self.conn.execute("SELECT crawl, date, source, names FROM crawls "
+                                 "ORDER BY date, crawl").fetchall()
+
+    def crawl(self, date = None):
+        """
+        Id of the latest crawl of `date`, or of the latest crawl, None
+        if there is none.
+        --------
+        date (str, date of the crawl)
+        """
+        if date is None:
+            row = self.conn.execute("SELECT crawl FROM crawls "
+                                    "ORDER BY date DESC, crawl DESC LIMIT 1").fetchone()
+        else:
+            row = self.conn.execute("SELECT crawl FROM crawls WHERE date = ? "
+                                    "ORDER BY crawl DESC LIMIT 1", (date,)).fetchone()
+        return row[0] if row else None
+
+    def roster(self, crawl = None):
+        """
+        [(school, page, name)] of a crawl, in the order of the pages.
+        --------
+        crawl (int, crawl id, default: the latest crawl)
+        """
+        crawl = self.crawl() if crawl is None else crawl
+        return self.conn.execute("SELECT school, page, name FROM rosters WHERE crawl = ? "
+                                 "ORDER BY school, page, position", (crawl,)).fetchall()
+
+    def faculty(self, crawl = None, rank = None):
+        """
+        [(school, page, name, rank)] of a crawl, of every rank or of
+        `rank` only, in the order of the pages.
+        --------
+        crawl (int, crawl id, default: the latest crawl)
+        rank (str, e.g. "assistant", "associate" or "full", see ranks.py)
+        """
+        crawl = self.crawl() if crawl is None else crawl
+        query = "SELECT school, page, name, rank FROM faculty WHERE crawl = ?"
+        if rank is not None:
+            return self.conn.execute(query + " AND rank = ? ORDER BY school, page, position",
+                                     (crawl, rank)).fetchall()
+        return self.conn.execute(query + " ORDER BY school, page, position", (crawl,)).fetchall()
+
+    def lookup(self, name, crawl = None):
+        """
+        [(date, school, page, name)] of every crawl, or of `crawl`, that
+        lists the person called `name`.
+        --------
+        name (str, name in any spelling normalize() reduces to the same key)
+        crawl (int, crawl id)
+        """
+        query = ("SELECT c.date, r.school, r.page, r.name FROM rosters r "
+                 "JOIN crawls c ON c.crawl = r.crawl WHERE r.key = ?")
+        if crawl is not None:
+            return self.conn.execute(query + " AND r.crawl = ?", (normalize(name), crawl)).fetchall()
+        return self.conn.execute(query + " ORDER BY c.date", (normalize(name),)).fetchall()
+
+    def diff(self, old, new):
+        """
+        {"added": [(school, name)], "removed": [(school, name)]} from
+        crawl `old` to crawl `new`.
+        --------
+        old (int, crawl id)
+        new (int, crawl id)
+        """
+        query = """
+            SELECT school, name FROM rosters a WHERE crawl = ? AND NOT EXISTS (
+                SELECT 1 FROM rosters b
+                WHERE b.crawl = ? AND b.school = a.school AND b.key = a.key)
+            ORDER BY school, name"""
+        return {"added": self.conn.execute(query, (new, old)).fetchall(),
+                "removed": self.conn.execute(query, (old, new)).fetchall()}
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+
+    # set argument parser
+    parser = argparse.ArgumentParser(description='Import, look up and compare rosters.')
+    parser.add_argument("-db", type = str,
+                        help = "SQLite file of the roster store.",
+                        default = "data/rosters.sqlite")
+    parser.add_argument("-namedir", type = str,
+                        help = "Import the json rosters of this directory as a crawl.")
+    parser.add_argument("-ranksdir", type = str,
+                        help = "Rank rosters imported with -namedir.")
+    parser.add_argument("-rank", type = str,
+                        help = "List the faculty of this rank in the latest crawl.")
+    parser.add_argument("-date", type = str,
+                        help = "Date of the imported crawl, default: today.")
+    parser.add_argument("-lookup", type = str,
+                        help = "List the crawls, schools and pages listing this person.")
+    parser.add_argument("-diff", type = str, nargs = 2, metavar = ("OLD", "NEW"),
+                        help = "Compare two crawls, each given by its id or its date "
+                               "(the latest crawl of that date).")
+    parser.add_argument("-v", "--verbose",
+                        help = "Set logging level to DEBUG.",
+                        action = "store_true")
+    args = parser.parse_args()
+
+    # set logging
+    log.setLevel(logging.WARNING)
+    if args.verbose:
+        log.setLevel(logging.DEBUG)
+    loghandler = logging.StreamHandler(sys.stderr)
+    loghandler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
+    log.addHandler(loghandler)
+
+    store = RosterStore(args.db)
+    if args.namedir:
+        store.write(read_dir(args.namedir), args.date, "import",
+                    read_dir(args.ranksdir) if args.ranksdir else None)
+    if args.lookup:
+        for row in store.lookup(args.lookup):
+            print("{}: {}, page {} ({})".format(*row))
+    if args.rank:
+        for row in store.faculty(rank = args.rank):
+            print("{}, page {}: {} ({})".format(*row))
+    if args.diff:
+        old, new = (int(crawl) if crawl.isdigit() else store.crawl(crawl)
+                    for crawl in args.diff)
+        if old is None or new is None:
+            parser.error("no crawl on {}".format(args.diff[0] if old is None else args.diff[1]))
+        for change, rows in store.diff(old, new).items():
+            for school, name in rows:
+                print("{} {}: {}".format("+" if change == "added" else "-", school, name))
+    if not (args.namedir or args.lookup or args.rank or args.diff):
+        for crawl, date, source, names in store.crawls():
+            print("{} {} {} names ({})".format(crawl, date, names, source))
+    store.close()
+
+    sys.exit()
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+One scheduler for every request the scripts make. Each host has a
+token bucket refilled at `rate` requests per second, a cap bounds the
+requests in flight across all hosts, 429 and 5xx answers are retried
+with exponential backoff and full jitter (or after Retry-After), and
+a host that keeps failing is left alone for `cooldown` seconds
+instead of being hammered. Sessions from make_session() go through
+the shared `default` scheduler, so all fetches of a process share the
+same per-host budget. With metrics on, every fetch is recorded with
+its timings.
+"""
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+import requests
+import metrics
+
+
+log = logging.getLogger(__name__)
+
+retry_status = {429, 500, 502, 503, 504}
+
+
+class CircuitOpen(requests.exceptions.ConnectionError):
+    """
+    The host failed too many times in a row and is not contacted
+    until its cooldown ends.
+    """
+
+
+class Host:
+    """
+    Token bucket and failure count of one host.
+    --------
+    rate (float, requests per second)
+    burst (int, requests allowed back to back)
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+
+class Scheduler:
+    """
+    --------
+    rate (float, requests per second to one host)
+    burst (int, requests allowed back to back to one host)
+    concurrency (int, requests in flight across all hosts)
+    retries (int, retries after a 429, 5xx or connection error)
+    backoff (float, seconds before the first retry, doubled after each)
+    max_backoff (float, longest wait between retries)
+    failures (int, failures in a row that open the circuit of a host)
+    cooldown (float, seconds a host is left alone once its circuit opens)
+    """
+
+    def __init__(self, rate = 2, burst = 2, concurrency = 16, retries = 4,
+                 backoff = 0.5, max_backoff = 30, failures = 5, cooldown = 60):
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = failures
+        self.cooldown = cooldown
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.hosts = {}
+        self.limits = {}
+        self.lock = threading.Lock()
+
+    def limit(self, host, rate, burst = 1):
+        """
+        Use a different rate for `host`.
+        --------
+        host (str, host name)
+        rate (float, requests per second)
+        burst (int, requests allowed back to back)
+        """
+        with self.lock:
+            self.limits[host] = (rate, burst)
+            self.hosts.pop(host, None)
+
+    def host(self, host):
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = Host(*self.limits.get(host, (self.rate, self.burst)))
+            return self.hosts[host]
+
+    def wait(self, host):
+        """
+        Take a token from the bucket of `host`, sleeping until one is
+        available. Raises CircuitOpen if the host is cooling down.
+        --------
+        host (str, host name)
+        """
+        state = self.host(host)
+        while True:
+            with state.lock:
+                now = time.monotonic()
+                if state.open_until > now:
+                    raise CircuitOpen("{} failed {} times in a row, retry in {:.0f}s".format(
+                        host, state.failures, state.open_until - now))
+                state.tokens = min(state.burst,
+                                   state.tokens + (now - state.updated) * state.rate)
+                state.updated = now
+                if state.tokens >= 1:
+                    state.tokens -= 1
+                    return
+                delay = (1 - state.tokens) / state.rate
+            time.sleep(delay)
+
+    @contextmanager
+    def slot(self, host):
+        """
+        Hold a token of `host` and one of the global slots while the
+        request runs.
+        --------
+        host (str, host name)
+        """
+        self.wait(host)
+        with self.slots:
+            yield
+
+    def record(self, host, ok):
+        """
+        Count a success or a failure of `host`, opening its circuit
+        after `failures` failures in a row.
+        --------
+        host (str, host name)
+        ok (bool, whether the request succeeded)
+        """
+        state = self.host(host)
+        with state.lock:
+            if ok:
+                state.failures = 0
+                return
+            state.failures += 1
+            if state.failures >= self.failures:
+                state.open_until = time.monotonic() + self.cooldown
+                log.error("Leaving {} alone for {}s after {} failures".format(
+                    host, self.cooldown, state.failures))
+
+    def delay(self, attempt, response = None):
+        """
+        Seconds to wait before retry number `attempt`: the server's
+        Retry-After if it sent one, else a random wait of up to
+        backoff * 2 ** attempt.
+        --------
+        attempt (int, retries made so far)
+        response (requests.Response, answer that is retried)
+        """
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                return min(self.max_backoff, float(retry_after))
+            except ValueError:
+                try:
+                    return min(self.max_backoff, max(0, parsedate_to_datetime(
+                        retry_after).timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+default = Scheduler()
+
+
+def configure(**kwargs):
+    """
+    Replace the shared scheduler, before any session is made.
+    --------
+    kwargs (settings passed to Scheduler)
+    """
+    global default
+    default = Scheduler(**kwargs)
+    return default
+
+
+class PoliteAdapter(requests.adapters.HTTPAdapter):
+    """
+    HTTPAdapter that sends every request through a Scheduler.
+    --------
+    scheduler (Scheduler)
+    """
+
+    def __init__(self, scheduler = None, **kwargs):
+        self.scheduler = scheduler or default
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        timings = {"queued": 0.0}
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                queued = time.perf_counter()
+                with self.scheduler.slot(host):
+                    timings["queued"] += time.perf_counter() - queued
+                    sent = time.perf_counter()
+                    r = super().send(request, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                if isinstance(e, CircuitOpen):
+                    raise
+                self.scheduler.record(host, False)
+                if attempt >= self.scheduler.retries:
+                    self.measure(request, None, start, sent, attempt, timings, str(e))
+                    raise
+                wait = self.scheduler.delay(attempt)
+                log.info("{} on {}, retrying in {:.1f}s".format(type(e).__name__,
+                                                                request.url, wait))
+            else:
+                if r.status_code not in retry_status:
+                    self.scheduler.record(host, True)
+                    self.measure(request, r, start, sent, attempt, timings,
+                                 stream = kwargs.get("stream"))
+                    return r
+                self.scheduler.record(host, False)
+                if attempt >= self.scheduler.retries:
+                    self.measure(request, r, start, sent, attempt, timings,
+                                 stream = kwargs.get("stream"))
+                    return r
+                wait = self.scheduler.delay(attempt, r)
+                log.info("{} from {}, retrying in {:.1f}s".format(r.status_code,
+                                                                  request.url, wait))
+                r.close()
+            attempt += 1
+            time.sleep(wait)
+
+    def measure(self, request, r, start, sent, attempt, timings, error = None,
+                stream = False):
+        """
+        Record the fetch in the metrics file. The body of a request
+        that is not streamed is read here so its transfer is timed.
+        --------
+        request (requests.PreparedRequest)
+        r (requests.Response, None if the request failed)
+        start (float, perf_counter when the request was first tried)
+        sent (float, perf_counter when the last attempt was sent)
+        attempt (int, retries made)
+        timings (dict, time waiting for the scheduler)
+        error (str, why the request failed)
+        stream (bool, whether the body is left to the caller)
+        """
+        if not metrics.enabled():
+            return
+        headers = time.perf_counter()
+        connect = metrics.connect_time()
+        dns = metrics.dns_time()
+        size = None
+        if r is not None and not stream:
+            size = len(r.content)
+        elif r is not None and r.headers.get("content-length", "").isdigit():
+            size = int(r.headers["content-length"])
+        end = time.perf_counter()
+        metrics.record("fetch", url = request.url, host = urlparse(request.url).netloc,
+                       method = request.method,
+                       status = r.status_code if r is not None else None,
+                       bytes = size, retries = attempt, error = error,
+                       dns = dns, connect = connect,
+                       queued = round(timings["queued"], 4),
+                       headers = round(headers - sent - (connect or 0), 4),
+                       transfer = None if stream else round(end - headers, 4),
+                       seconds = round(end - start, 4))
+
+
+def make_session(pool_size, scheduler = None):
+    """
+    Create a session that keeps connections alive between requests
+    and sends them through `scheduler`.
+    --------
+    pool_size (int, number of connections kept open per host)
+    scheduler (Scheduler, default: the shared one)
+    """
+    s = requests.Session()
+    adapter = PoliteAdapter(scheduler, pool_connections = pool_size,
+                            pool_maxsize = pool_size)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
@@ -5,29 +5,82 @@ pdf or html file, and parse them.
 
 
 import os
-from googlesearch import search
+import download
+import cv_store
+import cv_search
+import profiles
+import scheduler
+import replay_server
+import roster_store
+import name_index
 import sys
 import argparse
 import logging
 import json
 import re
 from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
 import requests
 import time
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
 
 # set argument parser
 parser = argparse.ArgumentParser(description=
                                  'Download and parse CVs.')
+parser.add_argument("-rosters", type = str,
+                    help = "SQLite roster store of the faculty to search for.",
+                    default = "data/rosters.sqlite")
 parser.add_argument("-namesdir", type = str,
-                    help = "Directory to store output of this file.",
+                    help = "Directory of the json rosters, imported when the roster store has none.",
                     default = "data/faculty_names")
 parser.add_argument("-cvdir", type = str,
                     help = "Directry to store CV's.",
                     default = "data/faculty_CV")
 parser.add_argument("-school", type = str, help = "Name of school.")
-parser.add_argument("-v", "--verbose", 
+parser.add_argument("-storedir", type = str,
+                    help = "Directory of the content-addressed CV store.",
+                    default = "data/cv_store")
+parser.add_argument("--no-cache",
+                    help = "Download every CV in full, even if unchanged.",
+                    action = "store_true")
+parser.add_argument("-search-backend", type = str,
+                    help = "Where search results come from.",
+                    choices = ["google", "local"],
+                    default = "google")
+parser.add_argument("-index", type = str,
+                    help = "Json file {query: [urls]} used by the local search backend.",
+                    default = "data/search_index.json")
+parser.add_argument("-results", type = int,
+                    help = "Number of search results kept per name.",
+                    default = 1)
+parser.add_argument("-searchcache", type = str,
+                    help = "Json file caching search results by query.",
+                    default = "data/search_cache.json")
+parser.add_argument("-search-ttl", type = float,
+                    help = "Days cached search results stay valid.",
+                    default = 90)
+parser.add_argument("-rate", type = float,
+                    help = "Search queries allowed per minute.",
+                    default = 30)
+parser.add_argument("-search-workers", type = int,
+                    help = "Number of searches running at the same time.",
+                    default = 4)
+parser.add_argument("-browsers", type = int,
+                    help = "Number of browsers kept open and reused across names.",
+                    default = 2)
+parser.add_argument("--show",
+                    help = "Show the browser windows instead of running headless.",
+                    action = "store_true")
+parser.add_argument("--no-browser",
+                    help = "Fetch and rank the search results without a browser.",
+                    action = "store_true")
+parser.add_argument("-timeout", type = float,
+                    help = "Seconds to wait for a search result to answer.",
+                    default = 15)
+parser.add_argument("-replay", type = str,
+                    help = "Base url of a replay_server.py to fetch the results from.")
+parser.add_argument("-v", "--verbose",
                     help = "Set logging level to DEBUG.",
                     action = "store_true")
 args = parser.parse_args()
@@ -49,6 +102,16 @@ loghandler = logging.StreamHandler(sys.stderr)
 loghandler.setFormatter(logging.Formatter("[%(asctime)s %(message)s]"))
 log.addHandler(loghandler)
 
+store = cv_store.CVStore(args.storedir)
+if args.search_backend == "local":
+    backend = cv_search.LocalIndex(args.index)
+else:
+    backend = cv_search.GoogleBackend(args.results)
+search_cache = profiles.ProfileCache(args.searchcache, args.search_ttl * 24 * 3600)
+scheduler.default.limit(cv_search.GoogleBackend.host, args.rate / 60)
+session = (replay_server.make_session(args.browsers, args.replay) if args.replay
+           else scheduler.make_session(args.browsers))
+
 
 
 
@@ -62,25 +125,18 @@ log.addHandler(loghandler)
 
 def search_cv(name, school):
     """
+    Search results that may be the CV of `name`, from the search
+    cache when the query was run recently.
+    --------
     name (str, name of the faculty)
     """
-    result = []
-    query = name + " CV"  + " pdf"
-    for r in search(query, tld = "com", num = 5, stop = 1, pause = 2):
-        if re.search(".pdf$", str(r)):
-            result.append(str(r))
-        elif re.search(".pdf?dl=0$", str(r)):
-            raw_url = str(r)
-            new_url = raw_url.replace(".pdf?dl=0$", ".pdf$")
-            result.append(new_url)
-        elif re.search("drive.google.com", str(r)):
-            result.append(str(r))
-    return result
+    query = cv_search.query(name)
+    found = cv_search.search_all([query], backend, search_cache, scheduler.default).get(query, [])
+    return [url for url in map(cv_search.classify, found) if url is not None]
 
 
 """STEP 1: download CV"""
 
-user_agent = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_3) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/72.0.3626.109 Safari/537.36"
 
 # download pdf and save meta information in json
 def download_cv(name, url):
@@ -88,78 +144,181 @@ def download_cv(name, url):
     name (str, name of the junior faculty)
     url (str, url of the professor's CV)
     """
-    r = requests.get(url, headers={
-            'Accept': 'text/html; charset=iso-8859-1',
-            'User-Agent': user_agent}) 
-    filename = name.replace(" ", "").replace(".", "")
-    
-    # save meta information in json
-    with open(os.path.join(args.cvdir, filename + ".json"), "w") as j:
-        json.dump(dict(r.headers), j)
-    if r.status_code != 200:
-        r.raise_for_status()
-    else:
-        if url.endswith(".pdf"):
-            with open(os.path.join(args.cvdir, filename + ".pdf"), "wb") as f:
-                f.write(r.content)
-        
-        elif url.endswith(".html"):
-            with open(os.path.join(args.cvdir, filename + ".html"), "w") as h:
-                h.write(r.text)
-        else:
-            with open(os.path.join(args.cvdr, filename), "wb") as g:
-                g.write(r.content)
-        log.info("CV accessed for {}".format(name))
+    download.download_cv(name, url, args.cvdir, session,
+                         revalidate = not args.no_cache, store = store)
+
+
+
+"""STEP 2: show the search results"""
+
 
+class BrowserPool:
+    """
+    Firefox instances started once and reused for every name. Each
+    browser keeps its tabs between names: the results of the next name
+    are loaded into the open tabs and only the surplus tabs are closed.
+    --------
+    size (int, number of browsers)
+    headless (bool, run without windows)
+    """
+
+    def __init__(self, size = 2, headless = True):
+        self.size = size
+        self.headless = headless
+        self.started = 0
+        self.idle = queue.Queue()
+        self.browsers = []
+
+    def start(self):
+        options = webdriver.FirefoxOptions()
+        options.add_argument("disable-infobars")
+        options.add_argument("--disable-notifications")
+        if self.headless:
+            options.add_argument("-headless")
+        options.set_preference("browser.tabs.remote.autostart", False)
+        options.set_preference("browser.tabs.remote.autostart.1", False)
+        options.set_preference("browser.tabs.remote.autostart.2", False)
+        browser = webdriver.Firefox(options = options)
+        self.browsers.append(browser)
+        return browser
+
+    def acquire(self):
+        """
+        An idle browser, started if fewer than `size` are running,
+        otherwise waited for.
+        """
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        if self.started < self.size:
+            self.started += 1
+            return self.start()
+        return self.idle.get()
+
+    def release(self, browser):
+        self.idle.put(browser)
+
+    def show(self, browser, urls):
+        """
+        Load `urls` into the tabs of `browser`, one per tab, and return
+        (title, url after redirects) of each.
+        --------
+        browser (webdriver.Firefox, acquired from the pool)
+        urls (list, urls to open)
+        """
+        seen = []
+        for i, url in enumerate(urls):
+            if i >= len(browser.window_handles):
+                browser.execute_script("window.open('');")
+            browser.switch_to.window(browser.window_handles[i])
+            browser.get(url)
+            seen.append((browser.title, browser.current_url))
+        # close the tabs left over from the previous name
+        for handle in browser.window_handles[max(len(urls), 1):]:
+            browser.switch_to.window(handle)
+            browser.close()
+        browser.switch_to.window(browser.window_handles[0])
+        return seen
+
+    def close(self):
+        for browser in self.browsers:
+            browser.quit()
+
+
+def triage(session, url, name):
+    """
+    Fetch the start of a search result and score how likely it is to
+    be the CV of `name`: a pdf, "cv" or "vitae" in the url or title,
+    and the last name in the url, title or text each add a point.
+    --------
+    session (requests.Session)
+    url (str, search result)
+    name (str, name of the faculty)
+    """
+    result = {"url": url, "score": 0}
+    try:
+        with session.get(url, headers = {"User-Agent": download.user_agent},
+                         stream = True, timeout = args.timeout) as r:
+            head = next(r.iter_content(64 * 1024), b"")
+            result.update(status = r.status_code, final_url = r.url,
+                          size = r.headers.get("content-length"))
+    except requests.exceptions.RequestException as e:
+        result.update(status = None, error = str(e))
+        return result
+    is_pdf = head.lstrip().startswith(b"%PDF")
+    text = "" if is_pdf else head.decode("utf-8", "ignore")
+    title = re.search(r"<title[^>]*>(.*?)</title>", text, re.I | re.S)
+    result["kind"] = "pdf" if is_pdf else r.headers.get("content-type", "").split(";")[0]
+    result["title"] = " ".join(title.group(1).split()) if title else ""
+    # accents and case left out, so "Gómez" on the roster finds "gomez" in a url
+    last = name_index.Name(name).last or roster_store.normalize(name)
+    described = roster_store.normalize(r.url + " " + result["title"])
+    result["score"] = (int(is_pdf) + int(bool(re.search(r"\bcv\b|vitae", described)))
+                       + int(last in described or last in roster_store.normalize(text)))
+    return result
+
+
+def candidates(name, school, pool, session):
+    """
+    Search for the CV of `name` and load the results, in a browser
+    of the pool or, with --no-browser, by fetching them directly.
+    Returns (urls, lines describing each result, browser or None).
+    --------
+    name (str, name of the faculty)
+    school (str, name of the school)
+    pool (BrowserPool)
+    session (requests.Session)
+    """
+    urls = search_cv(name, school)
+    if args.no_browser:
+        results = sorted((triage(session, url, name) for url in urls),
+                         key = lambda result: -result["score"])
+        return [result["url"] for result in results], [
+            "[{score}] {status} {kind} {size} {url} {title}".format(**dict(
+                {"kind": "", "size": "", "title": result.get("error", "")}, **result))
+            for result in results], None
+    browser = pool.acquire()
+    try:
+        seen = pool.show(browser, urls)
+    except Exception:
+        pool.release(browser)
+        raise
+    return urls, ["{} {}".format(url, title) for title, url in seen], browser
 
 
 if __name__ == "__main__":
     
-    (_, _, filenames) = next(os.walk(args.namesdir))
-    filenames.remove('.DS_Store')
-    
-    
-    
-    for file in filenames:
-        args.school = file.replace('.json', '')
-        with open(os.path.join(args.namesdir, file), "r") as f:
-            names = json.load(f)
-        for name in names:
-            if re.search('people', name, re.IGNORECASE):
-                continue
-            else:
-                urls = search_cv(name, args.school)
-                log.info("{}, {}:\n {}".format(name, args.school, urls))
-                options = webdriver.FirefoxOptions()
-                options.add_argument("disable-infobars")
-                options.add_argument("--disable-notifications")
-                profile = webdriver.FirefoxProfile()
-                profile.set_preference("browser.tabs.remote.autostart",
-                                       False)
-                profile.set_preference("browser.tabs.remote.autostart.1",
-                                       False)
-                profile.set_preference("browser.tabs.remote.autostart.2",
-                                       False)
-                browser = webdriver.Firefox(options = options, 
-                                            firefox_profile = profile)
-                for u in urls:
-                    browser.get(u)
-                    time.sleep(2)
-                    elem = browser.find_element_by_tag_name('body')
-                    elem.send_keys(Keys.COMMAND + "t")
-                    windows = browser.window_handles
-                    browser.switch_to.window(windows[1])
-                    time.sleep(2)
+    people = [(name, school) for school, _, name
+              in roster_store.open_store(args.rosters, args.namesdir).roster()
+              if not re.search('people', name, re.IGNORECASE)]
+
+    # search every name at once, within the rate limit of the backend
+    cv_search.search_all([cv_search.query(name) for name, _ in people], backend,
+                         search_cache, scheduler.default, args.search_workers)
+
+    pool = BrowserPool(args.browsers, headless = not args.show)
+    # the results of the next name load while the current one is reviewed
+    with ThreadPoolExecutor(max_workers = 1) as ahead:
+        future = ahead.submit(candidates, *people[0], pool, session) if people else None
+        for i, (name, school) in enumerate(people):
+            urls, lines, browser = future.result()
+            if i + 1 < len(people):
+                future = ahead.submit(candidates, *people[i + 1], pool, session)
+            log.info("{}, {}:\n {}".format(name, school, urls))
+            print("{}, {}".format(name, school))
+            for line in lines:
+                print("  " + line)
             cv_url = input("Enter the url or press F: ")
-            if cv_url == 'f':
+            if browser is not None:
+                pool.release(browser)
+            if cv_url.lower() == 'f':
                 continue
-            else:
-                try:
-                    download_cv(name, cv_url)
-                except requests.exceptions.HTTPError:
-                    log.warning("HTTP error at {}".format(cv_url))
-            browser.quit()
+            try:
+                download_cv(name, cv_url)
+            except requests.exceptions.HTTPError:
+                log.warning("HTTP error at {}".format(cv_url))
+    pool.close()
             
             
     sys.exit()
-    
\ No newline at end of file